@@ -102,6 +102,26 @@ async def get_status(job_id: str):
 async def list_jobs():
     return list(jobs.keys())
 
+@app.get("/metrics")
+async def get_metrics(scope: str = "volume", since: float = 0):
+    """Per-stage p50/p95 latencies aggregated by the workers"""
+    if not RUNPOD_API_KEY or not RUNPOD_ENDPOINT_ID:
+        raise HTTPException(status_code=500, detail="RunPod credentials not configured")
+    
+    url = f"https://api.runpod.ai/v2/{RUNPOD_ENDPOINT_ID}/runsync"
+    headers = {
+        "Authorization": f"Bearer {RUNPOD_API_KEY}",
+        "Content-Type": "application/json"
+    }
+    payload = {"input": {"action": "metrics", "scope": scope, "since": since}}
+    
+    async with aiohttp.ClientSession() as session:
+        async with session.post(url, json=payload, headers=headers) as response:
+            result = await response.json()
+            if response.status != 200:
+                raise HTTPException(status_code=502, detail=result.get("error", "Unknown error"))
+            return result.get("output", {}).get("metrics", {})
+
 @app.post("/test-local")
 async def test_local_generation(request: ImageGenerationRequest):
     """Test endpoint that returns a gradient image for local development"""
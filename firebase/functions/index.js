@@ -251,6 +251,10 @@ exports.generateImageSecure = functions
         // If custom LoRA URL is provided, include it
         ...(data.lora_url && { lora_url: data.lora_url })
       }),
+      // Stacked LoRAs ([{name, strength, url}]) are applied in one pass
+      ...(Array.isArray(data.loras) && data.loras.length > 0 && { loras: data.loras }),
+      // The worker abandons the job (and frees the GPU) once this function can no longer return it
+      deadline: Math.floor(startTime / 1000) + 520,
       // FLUX doesn't use these traditional parameters
       // num_inference_steps: validatedInput.steps,
       // guidance_scale: validatedInput.guidance_scale,
@@ -332,6 +336,13 @@ exports.generateImageSecure = functions
       }
       
       if (attempts >= maxAttempts) {
+        // Tell RunPod nobody is waiting so the worker withdraws the prompt from ComfyUI
+        await fetch(`https://api.runpod.ai/v2/${RUNPOD_ENDPOINT_ID}/cancel/${result.id}`, {
+          method: 'POST',
+          headers: {
+            'Authorization': `Bearer ${RUNPOD_API_KEY}`,
+          }
+        }).catch(error => console.error('Failed to cancel RunPod job:', error));
         throw new functions.https.HttpsError('deadline-exceeded', 'Image generation timed out after 8 minutes');
       }
     }
@@ -5,13 +5,15 @@ This ensures LoRAs are ready to use without downloading during generation
 """
 
 import json
-import requests
 import boto3
 from botocore.config import Config
 import os
 import sys
 from datetime import datetime
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'runpod', 'src'))
+from ranged_download import HttpSource, download
+
 # S3 Configuration
 S3_CONFIG = {
     'endpoint': 'https://s3api-us-ks-2.runpod.io',
@@ -38,23 +40,17 @@ def create_s3_client():
     )
 
 def download_from_url(url, local_path):
-    """Download file from URL with progress"""
+    """Download file from URL with progress (parallel ranged download)"""
     print(f"Downloading from Firebase Storage...")
-    response = requests.get(url, stream=True)
-    response.raise_for_status()
-    
-    total_size = int(response.headers.get('content-length', 0))
-    downloaded = 0
-    
-    with open(local_path, 'wb') as f:
-        for chunk in response.iter_content(chunk_size=8192):
-            f.write(chunk)
-            downloaded += len(chunk)
-            if total_size > 0:
-                percent = (downloaded / total_size) * 100
-                print(f"\rProgress: {percent:.1f}%", end='', flush=True)
-    print("\n✓ Download complete")
-    return downloaded
+    
+    def on_progress(downloaded, total_size):
+        if total_size:
+            percent = (downloaded / total_size) * 100
+            print(f"\rProgress: {percent:.1f}%", end='', flush=True)
+    
+    stats = download(HttpSource(url), local_path, on_progress=on_progress)
+    print(f"\n✓ Download complete ({stats['mb_per_s']} MB/s, {stats['parts']} parts)")
+    return stats['bytes']
 
 def check_s3_exists(s3_client, key):
     """Check if file already exists in S3"""
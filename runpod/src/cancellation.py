@@ -0,0 +1,174 @@
+"""
+Job cancellation for ComfyUI-backed workers
+A job carries a CancelToken with an optional deadline from its input. The
+token is also tripped when RunPod reports the job as cancelled or the caller
+goes away. Once the token trips, the job's prompt is removed from ComfyUI:
+/queue delete if it is still pending, /interrupt if it is running. That way
+an abandoned generation does not hold the GPU for the jobs queued behind it.
+"""
+
+import threading
+import time
+from typing import Dict, Any, Optional
+
+import requests
+
+from runpod.serverless.modules.rp_logger import RunPodLogger
+
+logger = RunPodLogger()
+
+# RunPod job states that mean nobody is waiting for the result any more
+CANCELLED_STATES = ("CANCELLED", "TIMED_OUT")
+
+
+class JobCancelled(Exception):
+    """Raised inside the job pipeline once its CancelToken has tripped"""
+
+    def __init__(self, reason: str, details: Optional[Dict[str, Any]] = None):
+        super().__init__(f"Job cancelled: {reason}")
+        self.reason = reason
+        self.details = details or {}
+
+
+class CancelToken:
+    """Cancellation flag for one job, tripped explicitly or by its deadline"""
+
+    def __init__(self, deadline: Optional[float] = None):
+        self.deadline = deadline
+        self.reason: Optional[str] = None
+        self._event = threading.Event()
+
+    def cancel(self, reason: str):
+        if self.reason is None:
+            self.reason = reason
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        if not self._event.is_set() and self.deadline is not None and time.time() >= self.deadline:
+            self.cancel("deadline")
+        return self._event.is_set()
+
+    def remaining(self, default: Optional[float] = None) -> Optional[float]:
+        """Seconds left before the deadline, capped at default"""
+        if self.deadline is None:
+            return default
+        left = max(0.0, self.deadline - time.time())
+        return left if default is None else min(left, default)
+
+    def check(self):
+        """Raise JobCancelled if the job should stop"""
+        if self.cancelled:
+            raise JobCancelled(self.reason)
+
+
+def deadline_from_input(job_input: Dict[str, Any]) -> Optional[float]:
+    """Absolute deadline from "deadline" (unix seconds) or "timeout" (seconds from now)"""
+    if job_input.get('deadline') is not None:
+        try:
+            return float(job_input['deadline'])
+        except (TypeError, ValueError):
+            raise ValueError("deadline must be a unix timestamp in seconds")
+    if job_input.get('timeout') is not None:
+        try:
+            timeout = float(job_input['timeout'])
+        except (TypeError, ValueError):
+            raise ValueError("timeout must be a number of seconds")
+        if timeout <= 0:
+            raise ValueError("timeout must be positive")
+        return time.time() + timeout
+    return None
+
+
+class CancelWatcher:
+    """Polls RunPod's /status for in-flight jobs and trips their tokens when cancelled"""
+
+    def __init__(self, endpoint_id: Optional[str], api_key: Optional[str], interval: float = 5.0):
+        self.endpoint_id = endpoint_id
+        self.api_key = api_key
+        self.interval = interval
+        self._tokens: Dict[str, CancelToken] = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._session = requests.Session()
+        self.counters = {"cancelled_jobs": 0, "interrupted": 0, "dequeued": 0, "reclaimed_gpu_seconds": 0.0}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.endpoint_id and self.api_key)
+
+    def watch(self, job_id: Optional[str], token: CancelToken):
+        if not job_id or not self.enabled:
+            return
+        with self._lock:
+            self._tokens[job_id] = token
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def unwatch(self, job_id: Optional[str]):
+        with self._lock:
+            self._tokens.pop(job_id, None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                watched = list(self._tokens.items())
+            for job_id, token in watched:
+                if token.cancelled:
+                    continue
+                try:
+                    response = self._session.get(
+                        f"https://api.runpod.ai/v2/{self.endpoint_id}/status/{job_id}",
+                        headers={'Authorization': f'Bearer {self.api_key}'},
+                        timeout=5
+                    )
+                    status = response.json().get('status') if response.ok else None
+                except Exception as e:
+                    logger.debug(f"Cancel check for {job_id} failed: {e}")
+                    continue
+                if status in CANCELLED_STATES:
+                    logger.info(f"Job {job_id} is {status} on RunPod, cancelling")
+                    token.cancel("runpod_cancel")
+
+    def record(self, interrupted: bool, dequeued: bool, reclaimed_seconds: float):
+        with self._lock:
+            self.counters["cancelled_jobs"] += 1
+            self.counters["interrupted"] += int(interrupted)
+            self.counters["dequeued"] += int(dequeued)
+            self.counters["reclaimed_gpu_seconds"] += reclaimed_seconds
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.counters, reclaimed_gpu_seconds=round(self.counters["reclaimed_gpu_seconds"], 1))
+
+
+def _queued_ids(items) -> set:
+    # /queue entries are [number, prompt_id, prompt, extra_data, outputs]
+    return {item[1] for item in items or [] if len(item) > 1}
+
+
+def withdraw_prompt(client, prompt_id: str) -> Dict[str, bool]:
+    """Take a prompt off the GPU: delete it while pending, interrupt it while running"""
+    result = {"dequeued": False, "interrupted": False}
+    try:
+        queue = client.queue()
+    except Exception as e:
+        logger.warn(f"Could not read the ComfyUI queue to withdraw {prompt_id}: {e}")
+        return result
+
+    if prompt_id in _queued_ids(queue.get('queue_pending')):
+        try:
+            client.delete_queued([prompt_id])
+            result["dequeued"] = True
+        except Exception as e:
+            logger.warn(f"Queue delete of {prompt_id} failed: {e}")
+    elif prompt_id in _queued_ids(queue.get('queue_running')):
+        try:
+            # Newer ComfyUI only interrupts if this prompt is still the one running
+            client.interrupt(prompt_id)
+            result["interrupted"] = True
+        except Exception as e:
+            logger.warn(f"Interrupt of {prompt_id} failed: {e}")
+    return result
@@ -0,0 +1,141 @@
+"""
+Canonical FLUX graph layout
+Every FLUX graph the worker queues (text-to-image, image-to-image, any LoRA
+stack) shares one loader subgraph: the UNET, CLIP and VAE loaders sit on the
+same node IDs with byte-identical inputs, so alternating between modes never
+makes ComfyUI re-run them. LoRA loaders are spliced in between the UNET and
+its consumers on fixed IDs instead of using a separate graph.
+"""
+
+import copy
+from typing import Dict, Any, List, Optional
+
+# Loader subgraph shared by all FLUX templates
+CANONICAL_LOADERS: Dict[str, Dict[str, Any]] = {
+    "37": {
+        "inputs": {
+            "unet_name": "flux1-dev-kontext_fp8_scaled.safetensors",
+            "weight_dtype": "default"
+        },
+        "class_type": "UNETLoader",
+        "_meta": {"title": "Load Diffusion Model"}
+    },
+    "38": {
+        "inputs": {
+            "clip_name1": "t5xxl_fp16.safetensors",
+            "clip_name2": "clip_l.safetensors",
+            "type": "flux",
+            "device": "default"
+        },
+        "class_type": "DualCLIPLoader",
+        "_meta": {"title": "Dual CLIP Load"}
+    },
+    "39": {
+        "inputs": {
+            "vae_name": "ae.safetensors"
+        },
+        "class_type": "VAELoader",
+        "_meta": {"title": "VAE Load"}
+    }
+}
+UNET_ID = "37"
+
+# Stacked LoRA loaders get node IDs 40, 41, ...
+LORA_NODE_BASE = 40
+
+
+def _is_link(value) -> bool:
+    return isinstance(value, (list, tuple)) and len(value) == 2 and isinstance(value[1], int)
+
+
+def _canonical_id(node) -> Optional[str]:
+    for node_id, canonical in CANONICAL_LOADERS.items():
+        if node.get("class_type") == canonical["class_type"] and dict(node.get("inputs", {})) == canonical["inputs"]:
+            return node_id
+    return None
+
+
+def canonicalize(workflow: Dict[str, Any]) -> Dict[str, Any]:
+    """Move loaders matching the canonical inputs onto the canonical IDs
+
+    Links are rewritten to follow, and nodes already sitting on a canonical ID
+    move to a free one. Graphs for other models are returned unchanged.
+    """
+    renames = {}
+    for node_id, node in workflow.items():
+        canonical_id = _canonical_id(node)
+        if canonical_id:
+            renames[str(node_id)] = canonical_id
+    if not renames:
+        return workflow
+
+    mapping = dict(renames)
+    # Displaced nodes go past both the template's IDs and the LoRA range
+    numeric = [int(n) for n in workflow if str(n).isdigit()]
+    next_free = max(numeric + [LORA_NODE_BASE + 99]) + 1
+    for canonical_id in set(renames.values()):
+        if canonical_id in workflow and canonical_id not in renames:
+            mapping[canonical_id] = str(next_free)
+            next_free += 1
+
+    result = {}
+    for node_id, node in workflow.items():
+        node_id = str(node_id)
+        if node_id in renames:
+            result[renames[node_id]] = copy.deepcopy(CANONICAL_LOADERS[renames[node_id]])
+            continue
+        inputs = {
+            name: [mapping.get(str(value[0]), str(value[0])), value[1]] if _is_link(value) else value
+            for name, value in node.get("inputs", {}).items()
+        }
+        result[mapping.get(node_id, node_id)] = dict(node, inputs=inputs)
+    return result
+
+
+def add_lora_chain(workflow, loras: List[Dict[str, Any]]) -> List[str]:
+    """Splice LoraLoaderModelOnly nodes for [{name, strength}] after the UNET
+
+    workflow is a WorkflowInstance built from a canonical template. Every
+    node that consumed the UNET's model now consumes the end of the chain.
+    Returns the loader node IDs in chain order.
+    """
+    if not loras:
+        return []
+    if UNET_ID not in workflow:
+        raise ValueError("Workflow has no canonical UNET loader to attach LoRAs to")
+
+    consumers = [
+        node_id for node_id, node in workflow.items()
+        if _is_link(node.get("inputs", {}).get("model")) and str(node["inputs"]["model"][0]) == UNET_ID
+    ]
+    nodes = {}
+    model_source = [UNET_ID, 0]
+    for index, lora in enumerate(loras):
+        node_id = str(LORA_NODE_BASE + index)
+        nodes[node_id] = {
+            "inputs": {
+                "lora_name": lora["name"],
+                "strength_model": lora["strength"],
+                "model": model_source
+            },
+            "class_type": "LoraLoaderModelOnly",
+            "_meta": {"title": "LoRA Loader (Model Only)"}
+        }
+        model_source = [node_id, 0]
+
+    for node_id in consumers:
+        workflow.edit(node_id)["inputs"]["model"] = model_source
+    workflow.add_nodes(nodes)
+    return list(nodes)
+
+
+def cache_report(workflow, cached_nodes, executed_nodes) -> Dict[str, Any]:
+    """Summary of ComfyUI's execution_cached hits for one prompt"""
+    cached = {str(n) for n in cached_nodes}
+    loaders = [node_id for node_id in CANONICAL_LOADERS if node_id in workflow]
+    return {
+        "cached_nodes": len(cached),
+        "executed_nodes": len({str(n) for n in executed_nodes} - cached),
+        "total_nodes": len(workflow),
+        "loaders_cached": bool(loaders) and all(node_id in cached for node_id in loaders)
+    }
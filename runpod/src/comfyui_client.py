@@ -0,0 +1,178 @@
+"""
+Shared HTTP client for worker-to-ComfyUI traffic
+Keeps pooled keep-alive connections to the local server, applies per-call
+timeouts and retries, and records per-endpoint latency
+"""
+
+import json
+import threading
+import time
+from types import MappingProxyType
+from typing import Dict, Any, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT = (3, 30)
+VIEW_TIMEOUT = (3, 120)
+
+
+def _json_default(value):
+    """Serialize frozen workflow nodes without copying them first"""
+    if isinstance(value, MappingProxyType):
+        return dict(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class EndpointStats:
+    """Latency counters for a single endpoint"""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, elapsed: float, ok: bool):
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        if not ok:
+            self.errors += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg_ms": round(self.total / self.count * 1000, 1) if self.count else 0.0,
+            "max_ms": round(self.max * 1000, 1)
+        }
+
+
+class ComfyUIClient:
+    """Pooled session with retry/backoff for the local ComfyUI server"""
+
+    def __init__(self, server_url: str = "http://localhost:8188", pool_size: int = 8,
+                 retries: int = 3, backoff_factor: float = 0.2, timeout=DEFAULT_TIMEOUT):
+        self.server_url = server_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+
+        # POST /prompt is not idempotent, so only GETs are retried automatically
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(["GET", "HEAD"]),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._stats: Dict[str, EndpointStats] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _endpoint(path: str) -> str:
+        """Collapse '/history/<id>' style paths into one counter"""
+        return "/" + path.strip('/').split('/')[0]
+
+    def request(self, method: str, path: str, timeout=None, **kwargs) -> requests.Response:
+        """Send a request to ComfyUI and record its latency"""
+        start = time.time()
+        ok = False
+        try:
+            response = self.session.request(
+                method,
+                f"{self.server_url}{path}",
+                timeout=timeout or self.timeout,
+                **kwargs
+            )
+            ok = response.status_code < 500
+            return response
+        finally:
+            elapsed = time.time() - start
+            endpoint = self._endpoint(path)
+            with self._lock:
+                stats = self._stats.setdefault(f"{method} {endpoint}", EndpointStats())
+                stats.record(elapsed, ok)
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request("POST", path, **kwargs)
+
+    def system_stats(self, timeout=(1, 2)) -> Dict:
+        response = self.get("/system_stats", timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def queue_prompt(self, workflow: Dict, client_id: Optional[str] = None,
+                     prompt_id: Optional[str] = None) -> requests.Response:
+        """POST a workflow to /prompt, the caller inspects the response
+
+        prompt_id picks the ID up front on ComfyUI versions that accept it;
+        older versions ignore it and assign their own.
+        """
+        payload = {"prompt": workflow}
+        if client_id:
+            payload["client_id"] = client_id
+        if prompt_id:
+            payload["prompt_id"] = prompt_id
+        return self.post(
+            "/prompt",
+            data=json.dumps(payload, default=_json_default),
+            headers={"Content-Type": "application/json"}
+        )
+
+    def queue(self) -> Dict:
+        return self.get("/queue").json()
+
+    def delete_queued(self, prompt_ids: List[str]):
+        """Remove pending prompts from the queue"""
+        response = self.post("/queue", json={"delete": list(prompt_ids)})
+        response.raise_for_status()
+
+    def interrupt(self, prompt_id: Optional[str] = None):
+        """Interrupt the running prompt (only prompt_id, on ComfyUI versions that support it)"""
+        response = self.post("/interrupt", json={"prompt_id": prompt_id} if prompt_id else {})
+        response.raise_for_status()
+
+    def history(self, prompt_id: str) -> Dict:
+        return self.get(f"/history/{prompt_id}").json()
+
+    def view(self, image: Dict, stream: bool = False) -> requests.Response:
+        """Fetch an output image described by a history/executed entry"""
+        response = self.get(
+            "/view",
+            params={
+                'filename': image['filename'],
+                'subfolder': image.get('subfolder', ''),
+                'type': image.get('type', 'output')
+            },
+            timeout=VIEW_TIMEOUT,
+            stream=stream
+        )
+        response.raise_for_status()
+        return response
+
+    def upload_image(self, data: bytes, filename: str, subfolder: str = "", overwrite: bool = True) -> Dict:
+        """Upload image bytes into ComfyUI's input directory, returns {name, subfolder, type}"""
+        response = self.post(
+            "/upload/image",
+            files={"image": (filename, data, "application/octet-stream")},
+            data={"subfolder": subfolder, "type": "input", "overwrite": "true" if overwrite else "false"}
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Snapshot of per-endpoint latency counters"""
+        with self._lock:
+            return {name: s.to_dict() for name, s in sorted(self._stats.items())}
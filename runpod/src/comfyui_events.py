@@ -0,0 +1,342 @@
+"""
+ComfyUI websocket event stream
+Tracks prompt execution over /ws so handlers return as soon as the output
+node finishes, with adaptive-backoff /history polling when the socket is down
+"""
+
+import json
+import struct
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Any, List, Optional, Iterable
+
+from runpod.serverless.modules.rp_logger import RunPodLogger
+
+try:
+    import websocket  # websocket-client
+except ImportError:
+    websocket = None
+
+from comfyui_client import ComfyUIClient
+
+logger = RunPodLogger()
+
+# Polling backoff used only while the websocket is unavailable
+POLL_MIN_INTERVAL = 0.25
+POLL_MAX_INTERVAL = 2.0
+POLL_BACKOFF = 1.5
+
+# Binary websocket frames: preview image, and preview image with JSON metadata
+PREVIEW_IMAGE = 1
+PREVIEW_IMAGE_WITH_METADATA = 4
+PREVIEW_FORMATS = {1: "jpeg", 2: "png"}
+
+
+class PromptState:
+    """Execution state of a single prompt as reported by ComfyUI"""
+
+    def __init__(self, prompt_id: str):
+        self.prompt_id = prompt_id
+        self.done = threading.Event()
+        self.outputs: Dict[str, Dict] = {}
+        self.error: Optional[Dict] = None
+        self.current_node: Optional[str] = None
+        self.progress = (0, 0)
+        self.queued_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        # First and latest sampler progress events (sampling time)
+        self.first_progress_at: Optional[float] = None
+        self.last_progress_at: Optional[float] = None
+        self.expected_nodes = set()
+        # Nodes ComfyUI served from its cache, and nodes it actually ran
+        self.cached_nodes: List[str] = []
+        self.executed_nodes = set()
+        self.source = "websocket"
+        # Called from the reader thread with (event, data) for progress and previews
+        self.listeners: List[Callable[[str, Dict[str, Any]], None]] = []
+
+    def notify(self, event: str, data: Dict[str, Any]):
+        for listener in list(self.listeners):
+            try:
+                listener(event, data)
+            except Exception as e:
+                logger.debug(f"Prompt listener failed: {e}")
+
+    @property
+    def images(self) -> List[Dict]:
+        """Saved output images in node order"""
+        images = []
+        for node_id in sorted(self.outputs, key=lambda n: (len(n), n)):
+            for image in self.outputs[node_id].get('images', []):
+                if image.get('type', 'output') == 'output':
+                    images.append(image)
+        return images
+
+    def timings(self) -> Dict[str, float]:
+        """Seconds spent queued, executing and sampling (when progress was seen)"""
+        result = {}
+        if self.started_at:
+            result["queue_wait"] = max(0.0, self.started_at - self.queued_at)
+            if self.finished_at:
+                result["execution"] = self.finished_at - self.started_at
+        if self.first_progress_at and self.last_progress_at:
+            # One step elapses before the first progress event
+            steps = max(1, self.progress[0])
+            result["sampling"] = (self.last_progress_at - self.first_progress_at) * steps / max(1, steps - 1)
+        return result
+
+
+class ComfyUIEventStream:
+    """Single websocket per worker, fanned out to per-prompt states"""
+
+    def __init__(self, client: ComfyUIClient, client_id: str = None):
+        self.client = client
+        self.ws_url = client.server_url.replace('http', 'ws', 1) + '/ws'
+        self.client_id = client_id or str(uuid.uuid4())
+        self._prompts: Dict[str, PromptState] = {}
+        self._lock = threading.Lock()
+        self._connected = threading.Event()
+        self._generation = 0
+        self._thread = None
+        self._stopped = False
+        # Prompt ComfyUI is currently running, for previews without metadata
+        self._executing: Optional[str] = None
+
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    def start(self):
+        """Start the background reader thread"""
+        if websocket is None:
+            logger.warn("websocket-client not installed - falling back to /history polling")
+            return
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+
+    def _run(self):
+        """Connect, read events and reconnect with backoff when the socket drops"""
+        delay = 0.5
+        while not self._stopped:
+            ws = None
+            try:
+                ws = websocket.create_connection(f"{self.ws_url}?clientId={self.client_id}", timeout=10)
+                ws.settimeout(30)
+                with self._lock:
+                    self._generation += 1
+                self._connected.set()
+                logger.info(f"ComfyUI event stream connected (client {self.client_id})")
+                delay = 0.5
+                while not self._stopped:
+                    try:
+                        message = ws.recv()
+                    except websocket.WebSocketTimeoutException:
+                        continue
+                    if isinstance(message, str):
+                        self._handle_message(message)
+                    elif message:
+                        self._handle_binary(message)
+            except Exception as e:
+                if self._connected.is_set():
+                    logger.warn(f"ComfyUI event stream dropped: {e}")
+            finally:
+                self._connected.clear()
+                if ws is not None:
+                    try:
+                        ws.close()
+                    except Exception:
+                        pass
+            time.sleep(delay)
+            delay = min(delay * 2, 5.0)
+
+    def track(self, prompt_id: str) -> PromptState:
+        """Start collecting events for a prompt this worker submits (idempotent)
+
+        Events for prompts that are not tracked, or already forgotten, are
+        dropped, so call this before the prompt is queued.
+        """
+        with self._lock:
+            state = self._prompts.get(prompt_id)
+            if state is None:
+                state = self._prompts[prompt_id] = PromptState(prompt_id)
+            return state
+
+    def _handle_binary(self, frame: bytes):
+        """Route a preview frame to the prompt it belongs to"""
+        if len(frame) < 8:
+            return
+        event_type = struct.unpack(">I", frame[:4])[0]
+        if event_type == PREVIEW_IMAGE:
+            prompt_id = self._executing
+            image_format = PREVIEW_FORMATS.get(struct.unpack(">I", frame[4:8])[0], "jpeg")
+            image = frame[8:]
+        elif event_type == PREVIEW_IMAGE_WITH_METADATA:
+            length = struct.unpack(">I", frame[4:8])[0]
+            try:
+                metadata = json.loads(frame[8:8 + length])
+            except ValueError:
+                return
+            prompt_id = metadata.get('prompt_id') or self._executing
+            image_format = str(metadata.get('image_type', 'image/jpeg')).split('/')[-1]
+            image = frame[8 + length:]
+        else:
+            return
+        with self._lock:
+            state = self._prompts.get(prompt_id) if prompt_id else None
+        if state is not None and state.listeners:
+            state.notify('preview', {'format': image_format, 'image': image})
+
+    def _handle_message(self, raw: str):
+        try:
+            message = json.loads(raw)
+        except ValueError:
+            return
+        data = message.get('data') or {}
+        prompt_id = data.get('prompt_id')
+        if not prompt_id:
+            return
+
+        event = message.get('type')
+        with self._lock:
+            state = self._prompts.get(prompt_id)
+        if state is None:
+            # Not ours, or already forgotten (trailing executing/success events)
+            return
+
+        if event == 'execution_start':
+            state.started_at = time.time()
+        elif event == 'execution_cached':
+            state.cached_nodes.extend(str(n) for n in data.get('nodes') or [])
+        elif event == 'executing':
+            state.current_node = data.get('node')
+            self._executing = prompt_id if data.get('node') is not None else None
+            if data.get('node') is not None:
+                state.executed_nodes.add(str(data['node']))
+            if state.started_at is None:
+                state.started_at = time.time()
+            if data.get('node') is None:
+                # node == None marks the end of the prompt
+                self._finish(state)
+        elif event == 'executed':
+            state.outputs[str(data.get('node'))] = data.get('output') or {}
+            self._check_expected(state)
+        elif event == 'progress':
+            state.progress = (data.get('value', 0), data.get('max', 0))
+            state.last_progress_at = time.time()
+            if state.first_progress_at is None:
+                state.first_progress_at = state.last_progress_at
+            state.notify('progress', {'step': state.progress[0], 'steps': state.progress[1], 'node': data.get('node')})
+        elif event == 'execution_success':
+            self._finish(state)
+        elif event in ('execution_error', 'execution_interrupted'):
+            state.error = dict(data, type=event)
+            self._finish(state)
+
+    def _check_expected(self, state: PromptState):
+        if state.expected_nodes and state.expected_nodes.issubset(state.outputs.keys()):
+            self._finish(state)
+
+    def _finish(self, state: PromptState):
+        if state.finished_at is None:
+            state.finished_at = time.time()
+        state.done.set()
+
+    def expect(self, prompt_id: str, output_nodes: Iterable[str]) -> PromptState:
+        """Register the output nodes whose completion finishes the prompt"""
+        state = self.track(prompt_id)
+        state.expected_nodes = {str(n) for n in output_nodes}
+        self._check_expected(state)
+        return state
+
+    def state(self, prompt_id: str) -> Optional[PromptState]:
+        """Tracked state of a prompt, without starting to track it"""
+        with self._lock:
+            return self._prompts.get(prompt_id)
+
+    def forget(self, prompt_id: str):
+        with self._lock:
+            self._prompts.pop(prompt_id, None)
+
+    def poll_history(self, prompt_id: str) -> bool:
+        """Fill prompt state from /history, returns True once the prompt is finished"""
+        history = self.client.history(prompt_id)
+        if prompt_id not in history:
+            return False
+
+        entry = history[prompt_id]
+        with self._lock:
+            state = self._prompts.get(prompt_id)
+        if state is None:
+            return False
+        for node_id, node_output in entry.get('outputs', {}).items():
+            state.outputs[str(node_id)] = node_output
+        status = entry.get('status') or {}
+        for name, details in status.get('messages', []):
+            if name == 'execution_cached' and not state.cached_nodes:
+                state.cached_nodes.extend(str(n) for n in details.get('nodes') or [])
+        if status.get('status_str') == 'error':
+            for name, details in status.get('messages', []):
+                if name == 'execution_error':
+                    state.error = dict(details, type=name)
+            if state.error is None:
+                state.error = {'type': 'execution_error', 'exception_message': 'Prompt failed'}
+        state.source = "history"
+        self._finish(state)
+        return True
+
+    def wait(self, prompt_id: str, timeout: float = 600, cancel=None) -> PromptState:
+        """Block until the prompt finishes, polling only while the socket is down
+        
+        cancel, if given, is checked on every iteration; its check() raises
+        to abandon the wait.
+        """
+        state = self.track(prompt_id)
+        start_time = time.time()
+        deadline = start_time + timeout
+        last_log_time = start_time
+        generation = self._generation
+        poll_interval = POLL_MIN_INTERVAL
+
+        while not state.done.is_set():
+            if cancel is not None:
+                cancel.check()
+            now = time.time()
+            if now >= deadline:
+                raise TimeoutError("Image generation timed out")
+
+            if now - last_log_time > 30:
+                logger.info(f"Still waiting for image... {int(now - start_time)}s elapsed")
+                last_log_time = now
+
+            if self.connected:
+                if generation != self._generation:
+                    # Reconnected mid-wait: events may have been missed
+                    generation = self._generation
+                    if self.poll_history(prompt_id):
+                        break
+                state.done.wait(min(deadline - now, 1.0))
+                poll_interval = POLL_MIN_INTERVAL
+                continue
+
+            if self.poll_history(prompt_id):
+                break
+            time.sleep(min(poll_interval, max(deadline - time.time(), 0)))
+            poll_interval = min(poll_interval * POLL_BACKOFF, POLL_MAX_INTERVAL)
+
+        if not state.error and not state.images and state.source == "websocket":
+            # Fully cached prompts finish without 'executed' events
+            self.poll_history(prompt_id)
+
+        if state.error:
+            message = state.error.get('exception_message') or state.error.get('type')
+            node = state.error.get('node_type') or state.error.get('node_id')
+            raise RuntimeError(f"ComfyUI execution failed{f' in {node}' if node else ''}: {message}")
+        return state
@@ -4,38 +4,24 @@ Supports both pre-defined templates and custom workflows
 """
 
 import runpod
-import json
-import requests
 import time
 import os
 import boto3
 from typing import Dict, Any, List, Optional
 import base64
-from io import BytesIO
-from PIL import Image
-import subprocess
-import threading
+from comfyui_client import ComfyUIClient
+from comfyui_server import ComfyUISupervisor
+from workflow_registry import WorkflowRegistry, WorkflowInstance
+from lora_cache import LoraCache
+from ranged_download import HttpSource, download
+from output_encoding import output_options, encode_async, content_type, extension
 
-# Start ComfyUI server in background
-def start_comfyui_server():
-    cmd = ["python", "main.py", "--listen", "0.0.0.0", "--port", "8188", "--gpu-only"]
-    subprocess.Popen(cmd, cwd="/ComfyUI")
-    
-    # Wait for server to start
-    for i in range(30):
-        try:
-            response = requests.get("http://localhost:8188/system_stats")
-            if response.status_code == 200:
-                print("ComfyUI server started successfully")
-                return
-        except:
-            pass
-        time.sleep(1)
-    raise Exception("Failed to start ComfyUI server")
+# Shared pooled client for all ComfyUI traffic
+comfy_client = ComfyUIClient("http://localhost:8188")
 
-# Initialize ComfyUI on container start
-threading.Thread(target=start_comfyui_server, daemon=True).start()
-time.sleep(10)  # Give it time to start
+# Start ComfyUI server on container start; readiness is awaited before serving jobs
+supervisor = ComfyUISupervisor(["python", "main.py", "--listen", "0.0.0.0", "--port", "8188", "--gpu-only"], cwd="/ComfyUI")
+supervisor.start()
 
 # S3/R2 client for image storage (optional)
 s3_client = None
@@ -47,76 +33,70 @@ if os.environ.get('R2_ENDPOINT'):
         aws_secret_access_key=os.environ.get('R2_SECRET_ACCESS_KEY')
     )
 
+# Local LoRA cache with LRU eviction (house LoRAs are pinned)
+lora_cache = LoraCache.from_env("/ComfyUI/models/loras")
+
 class ComfyUIHandler:
     def __init__(self):
-        self.server_url = "http://localhost:8188"
+        self.server_url = comfy_client.server_url
         self.workflow_dir = "/workflows"
+        # Parse templates once; edits on the volume are hot-reloaded
+        self.registry = WorkflowRegistry(["/runpod-volume/workflows", self.workflow_dir])
+        self.registry.load_all()
+        self.registry.start_watcher()
         
-    def load_workflow_template(self, template_name: str) -> Dict:
-        """Load a pre-defined workflow template"""
-        template_path = os.path.join(self.workflow_dir, f"{template_name}.json")
-        if os.path.exists(template_path):
-            with open(template_path, 'r') as f:
-                return json.load(f)
-        else:
+    def load_workflow_template(self, template_name: str) -> WorkflowInstance:
+        """Instantiate a pre-defined workflow template"""
+        try:
+            return self.registry.instantiate(template_name)
+        except FileNotFoundError:
             raise ValueError(f"Workflow template '{template_name}' not found")
     
-    def update_workflow_inputs(self, workflow: Dict, inputs: Dict) -> Dict:
+    def update_workflow_inputs(self, workflow: Dict, inputs: Dict) -> WorkflowInstance:
         """Update workflow with user inputs"""
-        # Find and update prompt nodes
-        for node_id, node in workflow.items():
-            if node.get("class_type") == "CLIPTextEncode":
-                if node.get("_meta", {}).get("title") == "Positive Prompt":
-                    node["inputs"]["text"] = inputs.get("prompt", "")
-                elif node.get("_meta", {}).get("title") == "Negative Prompt":
-                    node["inputs"]["text"] = inputs.get("negative_prompt", "")
-            
-            # Update model selection
-            elif node.get("class_type") == "CheckpointLoaderSimple":
-                if "model" in inputs:
-                    node["inputs"]["ckpt_name"] = inputs["model"]
-            
-            # Update LoRA nodes
-            elif node.get("class_type") in ["LoraLoader", "LoraLoaderModelOnly"]:
-                if "lora" in inputs:
-                    node["inputs"]["lora_name"] = inputs["lora"]["name"]
-                    node["inputs"]["strength_model"] = inputs["lora"].get("strength", 0.8)
-                    node["inputs"]["strength_clip"] = inputs["lora"].get("strength", 0.8)
-            
-            # Update sampler settings
-            elif node.get("class_type") == "KSampler":
-                if "seed" in inputs:
-                    node["inputs"]["seed"] = inputs["seed"]
-                if "steps" in inputs:
-                    node["inputs"]["steps"] = inputs["steps"]
-                if "cfg" in inputs:
-                    node["inputs"]["cfg"] = inputs["cfg"]
-                if "sampler_name" in inputs:
-                    node["inputs"]["sampler_name"] = inputs["sampler_name"]
-                if "scheduler" in inputs:
-                    node["inputs"]["scheduler"] = inputs["scheduler"]
-            
-            # Update image dimensions
-            elif node.get("class_type") == "EmptyLatentImage":
-                if "width" in inputs:
-                    node["inputs"]["width"] = inputs["width"]
-                if "height" in inputs:
-                    node["inputs"]["height"] = inputs["height"]
-                if "batch_size" in inputs:
-                    node["inputs"]["batch_size"] = inputs["batch_size"]
+        if not isinstance(workflow, WorkflowInstance):
+            workflow = WorkflowInstance(workflow, name="custom")
+
+        # Prompt nodes
+        workflow.set_inputs("positive_prompt", text=inputs.get("prompt", ""))
+        workflow.set_inputs("negative_prompt", text=inputs.get("negative_prompt", ""))
+
+        # Update model selection
+        if "model" in inputs:
+            workflow.set_inputs("checkpoint", ckpt_name=inputs["model"])
+
+        # Update LoRA nodes
+        if "lora" in inputs:
+            strength = inputs["lora"].get("strength", 0.8)
+            workflow.set_inputs(
+                "lora_chain",
+                lora_name=inputs["lora"]["name"],
+                strength_model=strength,
+                strength_clip=strength
+            )
+
+        # Update sampler settings
+        if "seed" in inputs:
+            workflow.set_seed(inputs["seed"])
+        sampler_inputs = {k: inputs[k] for k in ("steps", "cfg", "sampler_name", "scheduler") if k in inputs}
+        if sampler_inputs:
+            workflow.set_inputs("sampler", **sampler_inputs)
+
+        # Update image dimensions
+        latent_inputs = {k: inputs[k] for k in ("width", "height", "batch_size") if k in inputs}
+        if latent_inputs:
+            workflow.set_inputs("latent", **latent_inputs)
         
         return workflow
     
     def queue_prompt(self, workflow: Dict) -> str:
         """Queue a workflow and return the prompt ID"""
-        p = {"prompt": workflow}
-        response = requests.post(f"{self.server_url}/prompt", json=p)
+        response = comfy_client.queue_prompt(workflow)
         return response.json()['prompt_id']
     
     def get_history(self, prompt_id: str) -> Optional[Dict]:
         """Get the history for a prompt ID"""
-        response = requests.get(f"{self.server_url}/history/{prompt_id}")
-        return response.json()
+        return comfy_client.history(prompt_id)
     
     def get_images(self, prompt_id: str) -> List[bytes]:
         """Wait for and retrieve generated images"""
@@ -130,14 +110,7 @@ class ComfyUIHandler:
                 for node_id, node_output in outputs.items():
                     if 'images' in node_output:
                         for image in node_output['images']:
-                            image_data = requests.get(
-                                f"{self.server_url}/view",
-                                params={
-                                    'filename': image['filename'],
-                                    'subfolder': image['subfolder'],
-                                    'type': image['type']
-                                }
-                            ).content
+                            image_data = comfy_client.view(image).content
                             images.append(image_data)
                 
                 return images
@@ -145,18 +118,18 @@ class ComfyUIHandler:
         
         raise TimeoutError("Image generation timed out")
     
-    def upload_to_storage(self, image_data: bytes, job_id: str, index: int) -> str:
+    def upload_to_storage(self, image_data: bytes, job_id: str, index: int, fmt: str = "png") -> str:
         """Upload image to R2/S3 and return URL"""
         if not s3_client:
             # If no S3, return base64 (fallback)
             return base64.b64encode(image_data).decode('utf-8')
         
-        key = f"comfyui/{job_id}/image_{index}.png"
+        key = f"comfyui/{job_id}/image_{index}.{extension(fmt)}"
         s3_client.put_object(
             Bucket=os.environ.get('R2_BUCKET'),
             Key=key,
             Body=image_data,
-            ContentType='image/png'
+            ContentType=content_type(fmt)
         )
         
         base_url = os.environ.get('R2_PUBLIC_URL', '').rstrip('/')
@@ -164,17 +137,11 @@ class ComfyUIHandler:
 
 def download_lora_if_needed(lora_name: str) -> bool:
     """Download LoRA file from Firebase Storage if not present locally"""
-    lora_dir = "/ComfyUI/models/loras"
-    lora_path = os.path.join(lora_dir, lora_name)
-    
     # Check if LoRA already exists
-    if os.path.exists(lora_path):
+    if lora_cache.lookup(lora_name):
         print(f"LoRA {lora_name} already exists locally")
         return True
     
-    # Ensure LoRA directory exists
-    os.makedirs(lora_dir, exist_ok=True)
-    
     # Firebase Storage URLs for known LoRAs
     firebase_urls = {
         "mix4.safetensors": "https://firebasestorage.googleapis.com/v0/b/amlwd-image-gen.firebasestorage.app/o/loras%2F1753591512468_mix4.safetensors?alt=media&token=d2c720b3-4aef-4ac4-8651-4a93b936fbeb",
@@ -184,14 +151,17 @@ def download_lora_if_needed(lora_name: str) -> bool:
     if lora_name in firebase_urls:
         try:
             print(f"Downloading LoRA {lora_name} from Firebase Storage...")
-            response = requests.get(firebase_urls[lora_name], stream=True)
-            response.raise_for_status()
             
-            with open(lora_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
+            stats = {}
+            
+            def fetch(tmp_path):
+                # Parallel ranged download into a temp file, renamed into place once verified
+                stats.update(download(HttpSource(firebase_urls[lora_name]), tmp_path))
+            
+            if not lora_cache.install(lora_name, fetch):
+                raise IOError("install failed")
             
-            print(f"Successfully downloaded LoRA {lora_name}")
+            print(f"Successfully downloaded LoRA {lora_name} ({stats['mb_per_s']} MB/s)")
             return True
         except Exception as e:
             print(f"Failed to download LoRA {lora_name}: {e}")
@@ -236,6 +206,7 @@ def handler(job):
     try:
         job_input = job['input']
         job_id = job.get('id', 'unknown')
+        output_format, output_quality = output_options(job_input)
         
         # Determine workflow source
         if 'custom_workflow' in job_input:
@@ -281,30 +252,35 @@ def handler(job):
                     job_input
                 )
         
-        # Queue the prompt
+        # Queue the prompt (waits out an in-progress ComfyUI restart)
+        supervisor.wait_ready()
         prompt_id = handler_instance.queue_prompt(workflow)
         print(f"Queued prompt: {prompt_id}")
         
         # Wait for and get images
         images = handler_instance.get_images(prompt_id)
         
-        # Process results
+        # Encode all images on the encoder pool, then deliver them in order
+        encodes = [encode_async(image_data, output_format, output_quality) for image_data in images]
         results = []
-        for i, image_data in enumerate(images):
+        for i, future in enumerate(encodes):
+            image_data, encoding = future.result()
             if s3_client:
                 # Upload to storage and return URL
-                url = handler_instance.upload_to_storage(image_data, job_id, i)
-                results.append({"url": url})
+                url = handler_instance.upload_to_storage(image_data, job_id, i, encoding["format"])
+                results.append({"url": url, **encoding})
             else:
                 # Return base64 (watch the size limit!)
                 b64 = base64.b64encode(image_data).decode('utf-8')
-                results.append({"base64": b64})
+                results.append({"base64": b64, **encoding})
         
         return {
             "status": "success",
             "images": results,
             "prompt_id": prompt_id,
-            "workflow_type": job_input.get('workflow_type', 'custom')
+            "workflow_type": job_input.get('workflow_type', 'custom'),
+            "comfyui_latency": comfy_client.stats(),
+            "lora_cache": lora_cache.stats()
         }
         
     except Exception as e:
@@ -316,5 +292,6 @@ def handler(job):
             "error": str(e)
         }
 
-# Start RunPod serverless worker
+# Start RunPod serverless worker once ComfyUI is actually up
+supervisor.wait_ready()
 runpod.serverless.start({"handler": handler})
\ No newline at end of file
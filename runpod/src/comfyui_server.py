@@ -0,0 +1,127 @@
+"""
+ComfyUI startup supervisor
+Launches the ComfyUI subprocess, gates the worker on real readiness probes
+instead of a fixed sleep, records boot-phase timings and restarts the
+server (or fails the worker fast) if it dies
+"""
+
+import os
+import subprocess
+import threading
+import time
+from typing import Dict, List, Optional
+
+from runpod.serverless.modules.rp_logger import RunPodLogger
+from comfyui_client import ComfyUIClient
+
+logger = RunPodLogger()
+
+PROBE_MIN_INTERVAL = 0.1
+PROBE_MAX_INTERVAL = 2.0
+
+
+class ComfyUISupervisor:
+    """Owns the ComfyUI process and its readiness state"""
+
+    def __init__(self, cmd: List[str], cwd: str = "/ComfyUI",
+                 server_url: str = "http://localhost:8188",
+                 boot_timeout: float = None, max_restarts: int = 2,
+                 exit_on_failure: bool = True):
+        self.cmd = cmd
+        self.cwd = cwd
+        self.boot_timeout = boot_timeout or float(os.environ.get('COMFYUI_BOOT_TIMEOUT', 180))
+        self.max_restarts = max_restarts
+        self.exit_on_failure = exit_on_failure
+        # Probes must fail fast, so they bypass the shared client's retry policy
+        self.probe_client = ComfyUIClient(server_url, pool_size=1, retries=0)
+
+        self.process: Optional[subprocess.Popen] = None
+        self.ready = threading.Event()
+        self.failed: Optional[str] = None
+        self.restarts = 0
+        self.timings: Dict[str, float] = {}
+        self._t0 = time.time()
+        self._lock = threading.Lock()
+
+    def _mark(self, phase: str):
+        self.timings[phase] = round(time.time() - self._t0, 3)
+
+    def start(self):
+        """Spawn ComfyUI and begin probing in the background"""
+        self._spawn()
+        threading.Thread(target=self._supervise, daemon=True).start()
+
+    def _spawn(self):
+        logger.info("Starting ComfyUI server...")
+        self._t0 = time.time()
+        self.timings = {}
+        self.process = subprocess.Popen(self.cmd, cwd=self.cwd)
+        self._mark("spawned")
+
+    def _probe(self, path: str) -> bool:
+        try:
+            response = self.probe_client.get(path, timeout=(0.5, 10))
+            return response.status_code == 200
+        except Exception:
+            return False
+
+    def _wait_for_boot(self) -> bool:
+        """Exponential-backoff probes of /system_stats then /object_info"""
+        deadline = self._t0 + self.boot_timeout
+        for phase, path in (("http_ready", "/system_stats"), ("nodes_ready", "/object_info")):
+            interval = PROBE_MIN_INTERVAL
+            while not self._probe(path):
+                if self.process.poll() is not None:
+                    logger.error(f"ComfyUI exited during boot with code {self.process.returncode}")
+                    return False
+                if time.time() >= deadline:
+                    logger.error(f"ComfyUI not ready after {self.boot_timeout:.0f}s ({path})")
+                    return False
+                time.sleep(interval)
+                interval = min(interval * 2, PROBE_MAX_INTERVAL)
+            self._mark(phase)
+        return True
+
+    def _supervise(self):
+        while True:
+            if self._wait_for_boot():
+                logger.info(f"ComfyUI server ready, boot timings: {self.timings}")
+                self.ready.set()
+                self.process.wait()
+                self.ready.clear()
+                logger.error(f"ComfyUI process died with code {self.process.returncode}")
+            else:
+                self._terminate()
+
+            with self._lock:
+                if self.restarts >= self.max_restarts:
+                    self._fail(f"ComfyUI failed after {self.restarts} restart(s)")
+                    return
+                self.restarts += 1
+            logger.warn(f"Restarting ComfyUI (attempt {self.restarts}/{self.max_restarts})")
+            self._spawn()
+
+    def _terminate(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+    def _fail(self, reason: str):
+        self.failed = reason
+        logger.error(reason)
+        # Wake anyone blocked in wait_ready
+        self.ready.set()
+        if self.exit_on_failure:
+            # Let RunPod replace the worker instead of accepting jobs it cannot run
+            os._exit(1)
+
+    def wait_ready(self, timeout: float = None) -> Dict[str, float]:
+        """Block until ComfyUI answers its readiness probes, returns boot timings"""
+        if not self.ready.wait(timeout if timeout is not None else self.boot_timeout):
+            raise TimeoutError("ComfyUI server did not become ready")
+        if self.failed:
+            raise RuntimeError(self.failed)
+        return self.timings
@@ -0,0 +1,132 @@
+"""
+Background disk garbage collector for the worker's local disk
+Each rule covers a directory and file patterns and sets an age limit and an
+optional free-space floor. When free space drops below the floor, the oldest
+matching files go first. Delivered outputs can be discarded straight away.
+"""
+
+import fnmatch
+import os
+import shutil
+import threading
+import time
+from typing import Dict, Any, Iterable, List, Optional
+
+from runpod.serverless.modules.rp_logger import RunPodLogger
+
+logger = RunPodLogger()
+
+
+class GCRule:
+    """Files under directory matching patterns, deleted past max_age or to keep min_free_bytes free"""
+
+    def __init__(self, directory: str, patterns: Iterable[str] = ("*",), max_age: float = 3600,
+                 min_free_bytes: int = 0, recursive: bool = False):
+        self.directory = directory
+        self.patterns = tuple(patterns)
+        self.max_age = max_age
+        self.min_free_bytes = min_free_bytes
+        self.recursive = recursive
+
+    def files(self) -> List[os.DirEntry]:
+        found = []
+        stack = [self.directory]
+        while stack:
+            try:
+                entries = list(os.scandir(stack.pop()))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if self.recursive:
+                        stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False) and any(fnmatch.fnmatch(entry.name, p) for p in self.patterns):
+                    found.append(entry)
+        return found
+
+
+class DiskGC:
+    """Periodic sweeper over a set of GC rules"""
+
+    def __init__(self, rules: Iterable[GCRule], interval: float = 60):
+        self.rules = list(rules)
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._thread = None
+        self.counters = {"sweeps": 0, "files_deleted": 0, "reclaimed_bytes": 0}
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.warn(f"Disk GC sweep failed: {e}")
+            time.sleep(self.interval)
+
+    def _delete(self, path: str, size: int) -> bool:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            logger.warn(f"Disk GC could not delete {path}: {e}")
+            return False
+        with self._lock:
+            self.counters["files_deleted"] += 1
+            self.counters["reclaimed_bytes"] += size
+        return True
+
+    def discard(self, path: Optional[str]) -> int:
+        """Delete a file that is no longer needed (e.g. an output already in R2), returns bytes freed"""
+        if not path:
+            return 0
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return 0
+        return size if self._delete(path, size) else 0
+
+    def sweep(self) -> int:
+        """One pass over every rule, returns bytes reclaimed"""
+        reclaimed = 0
+        now = time.time()
+        for rule in self.rules:
+            survivors = []
+            for entry in rule.files():
+                try:
+                    stat = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                if now - stat.st_mtime > rule.max_age:
+                    if self._delete(entry.path, stat.st_size):
+                        reclaimed += stat.st_size
+                        continue
+                survivors.append((stat.st_mtime, entry.path, stat.st_size))
+
+            if rule.min_free_bytes:
+                # Under disk pressure, the oldest matching files go first regardless of age
+                survivors.sort()
+                for _, path, size in survivors:
+                    try:
+                        if shutil.disk_usage(rule.directory).free >= rule.min_free_bytes:
+                            break
+                    except OSError:
+                        break
+                    if self._delete(path, size):
+                        reclaimed += size
+
+        with self._lock:
+            self.counters["sweeps"] += 1
+        if reclaimed:
+            logger.info(f"Disk GC reclaimed {reclaimed / (1024 * 1024):.1f} MB")
+        return reclaimed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.counters)
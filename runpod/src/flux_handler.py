@@ -4,47 +4,110 @@ Supports basic text-to-image generation with FLUX
 """
 
 import runpod
+import asyncio
+import contextvars
 from runpod.serverless.modules.rp_logger import RunPodLogger
-import json
 import requests
 import time
 import os
 import boto3
 import base64
-from typing import Dict, Any
-import subprocess
-import threading
-import urllib.request
+import hashlib
+from typing import Dict, Optional
 import random
 import uuid
 import traceback
+from concurrent.futures import ThreadPoolExecutor
+from comfyui_client import ComfyUIClient
+from comfyui_events import ComfyUIEventStream
+from comfyui_server import ComfyUISupervisor
+from workflow_registry import WorkflowRegistry, WorkflowInstance
+from canonical_graph import add_lora_chain, cache_report
+from lora_cache import LoraCache
+from lora_manifest import LoraManifest
+from volume_credentials import CredentialBootstrap, S3Volume
+from ranged_download import HttpSource, S3Source, download
+from singleflight import SingleFlight
+from output_stream import stream_to_r2, stream_to_base64, CHUNK_SIZE
+from output_encoding import output_options, encode_async, content_type, extension
+from job_metrics import SpanRecorder, MetricsLog, aggregate, begin_job, current as current_spans, span
+from resolution_planner import plan_resolution, use_tiled_decode
+from cancellation import CancelToken, CancelWatcher, JobCancelled, deadline_from_input, withdraw_prompt
+from result_cache import ResultCache, request_key, workflow_key
+from input_images import InputImageStore, decode_base64_image, SUBFOLDER as INPUT_SUBFOLDER
+from disk_gc import DiskGC, GCRule
+from safetensors_probe import read_header, read_header_file, classify, is_compatible
 
 # Initialize RunPod logger
 logger = RunPodLogger()
 
-# Start ComfyUI server
-def start_comfyui_server():
-    logger.info("Starting ComfyUI server...")
-    cmd = ["python", "main.py", "--listen", "0.0.0.0", "--port", "8188"]
-    subprocess.Popen(cmd, cwd="/ComfyUI")
-    
-    # Wait for server to start
-    for i in range(30):
-        try:
-            response = requests.get("http://localhost:8188/system_stats")
-            if response.status_code == 200:
-                logger.info("ComfyUI server started successfully")
-                return
-        except Exception as e:
-            if i % 5 == 0:
-                logger.debug(f"Waiting for ComfyUI... attempt {i}/30")
-        time.sleep(1)
-    raise Exception("Failed to start ComfyUI server")
+# Shared pooled client for all ComfyUI traffic
+comfy_client = ComfyUIClient("http://localhost:8188")
 
-# Start server on container start
+# Start ComfyUI server on container start; readiness is awaited before serving jobs
 logger.info("Initializing FLUX handler...")
-threading.Thread(target=start_comfyui_server, daemon=True).start()
-time.sleep(10)
+# latent2rgb previews are nearly free and feed the streamed preview frames
+supervisor = ComfyUISupervisor(
+    ["python", "main.py", "--listen", "0.0.0.0", "--port", "8188", "--preview-method", "latent2rgb"],
+    cwd="/ComfyUI"
+)
+supervisor.start()
+
+# Subscribe to ComfyUI execution events (reconnects until the server is up)
+event_stream = ComfyUIEventStream(comfy_client)
+event_stream.start()
+
+# Load workflow templates once; later edits on the volume are hot-reloaded
+workflow_registry = WorkflowRegistry([
+    "/runpod-volume/workflows",
+    "/workflows",
+    "/src/workflows",
+    "/app/workflows",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "workflows")
+])
+workflow_registry.load_all()
+workflow_registry.start_watcher()
+logger.info(f"Workflow templates available: {workflow_registry.names()}")
+
+# img2img inputs go straight to ComfyUI's input directory, deduplicated by content
+input_images = InputImageStore(comfy_client, keep=int(os.environ.get('INPUT_IMAGE_KEEP', 8)))
+
+# Local LoRA cache with LRU eviction (house LoRAs are pinned)
+lora_cache = LoraCache.from_env()
+
+# Background GC: delivered/stale outputs, leftover inputs and partial LoRA downloads
+COMFYUI_OUTPUT_DIR = "/ComfyUI/output"
+disk_gc = DiskGC([
+    GCRule(COMFYUI_OUTPUT_DIR, max_age=3600, recursive=True),
+    GCRule("/ComfyUI/temp", max_age=3600, recursive=True),
+    GCRule(os.path.join("/ComfyUI/input", INPUT_SUBFOLDER), max_age=86400),
+    GCRule("/tmp", ("input_*.png", "*.safetensors"), max_age=3600),
+    *[
+        GCRule(directory, ("*.part",), max_age=3600)
+        for directory in (lora_cache.cache_dir, "/runpod-volume/ComfyUI/models/loras", "/workspace/ComfyUI/models/loras")
+    ]
+], interval=float(os.environ.get('DISK_GC_INTERVAL', 60)))
+disk_gc.start()
+# Serializes download_lora actions for the same file on the persistent volume
+volume_lora_flights = SingleFlight(lock_dir="/runpod-volume/ComfyUI/models/loras")
+
+# Stage timings: worker startup once, then one recorder per job
+startup_spans = SpanRecorder()
+metrics_log = MetricsLog(os.environ.get('METRICS_DIR', '/runpod-volume/metrics'))
+
+# Trips job cancel tokens when RunPod reports the job cancelled
+cancel_watcher = CancelWatcher(
+    os.environ.get('RUNPOD_ENDPOINT_ID'),
+    os.environ.get('RUNPOD_API_KEY'),
+    interval=float(os.environ.get('CANCEL_POLL_INTERVAL', 5))
+)
+
+# Index of seed-pinned results already in R2, shared by workers on the volume
+result_cache = ResultCache(
+    os.environ.get('RESULT_CACHE_PATH', '/runpod-volume/cache/results.sqlite'),
+    max_entries=int(os.environ.get('RESULT_CACHE_MAX_ENTRIES', 5000)),
+    ttl=float(os.environ.get('RESULT_CACHE_TTL_DAYS', 30)) * 86400
+)
 
 # R2 client setup (optional)
 s3_client = None
@@ -60,11 +123,7 @@ if os.environ.get('R2_ENDPOINT'):
 else:
     logger.warn("R2 not configured - will return base64")
 
-# S3 volume client setup for LoRA storage
-s3_volume_client = None
-s3_credentials = {}
-
-# Try to fetch S3 credentials from Firebase
+# S3 volume credentials for LoRA storage, resolved in the background
 def fetch_s3_credentials():
     """Fetch S3 credentials from Firebase Cloud Function"""
     try:
@@ -90,261 +149,105 @@ def fetch_s3_credentials():
         logger.warn(f"Error fetching S3 credentials: {e}")
         return None
 
-# Try Firebase first, then fall back to environment variables
-firebase_creds = fetch_s3_credentials()
+def env_s3_credentials():
+    """Fall back to environment variables"""
+    if not os.environ.get('S3_ENDPOINT'):
+        return None
+    return {
+        'S3_ENDPOINT': os.environ.get('S3_ENDPOINT'),
+        'S3_BUCKET': os.environ.get('S3_BUCKET'),
+        'S3_ACCESS_KEY': os.environ.get('S3_ACCESS_KEY'),
+        'S3_SECRET_KEY': os.environ.get('S3_SECRET_KEY')
+    }
 
-if firebase_creds:
-    s3_credentials = firebase_creds
-    logger.info("Using S3 credentials from Firebase")
-else:
-    # Fall back to environment variables
-    if os.environ.get('S3_ENDPOINT'):
-        s3_credentials = {
-            'S3_ENDPOINT': os.environ.get('S3_ENDPOINT'),
-            'S3_BUCKET': os.environ.get('S3_BUCKET'),
-            'S3_ACCESS_KEY': os.environ.get('S3_ACCESS_KEY'),
-            'S3_SECRET_KEY': os.environ.get('S3_SECRET_KEY')
-        }
-        logger.info("Using S3 credentials from environment variables")
+# Firebase first, then environment variables; an encrypted copy on the volume
+# skips the Firebase round-trip on later cold starts. The time it took is in
+# the s3_credentials stats (resolve_seconds), not in the startup spans
+credential_bootstrap = CredentialBootstrap(
+    fetch_s3_credentials,
+    env_s3_credentials,
+    cache_path=os.environ.get('S3_CREDENTIALS_CACHE', '/runpod-volume/cache/s3_credentials.enc'),
+    secret=os.environ.get('RUNPOD_API_KEY', ''),
+    ttl=float(os.environ.get('S3_CREDENTIALS_TTL', 6 * 3600))
+)
+credential_bootstrap.start()
 
-# Setup S3 client if credentials available
-if s3_credentials.get('S3_ENDPOINT') and s3_credentials.get('S3_ACCESS_KEY'):
-    logger.info("Setting up S3 volume client for LoRA storage...")
-    from botocore.config import Config
-    
-    config = Config(
-        region_name='US-KS-2',
-        signature_version='s3v4',
-        s3={'addressing_style': 'path'}
-    )
-    
-    s3_volume_client = boto3.client(
-        's3',
-        endpoint_url=s3_credentials['S3_ENDPOINT'],
-        aws_access_key_id=s3_credentials['S3_ACCESS_KEY'],
-        aws_secret_access_key=s3_credentials['S3_SECRET_KEY'],
-        config=config
-    )
-    logger.info(f"S3 volume client configured for bucket: {s3_credentials['S3_BUCKET']}")
-else:
-    logger.warn("S3 volume not configured - LoRAs will use local storage")
+# boto3 client is only built by the first LoRA lookup
+s3_volume = S3Volume(credential_bootstrap, wait=float(os.environ.get('S3_CREDENTIALS_WAIT', 15)))
+
+# In-memory index of LoRAs in the S3 volume, replaces per-job HEAD requests
+lora_manifest = LoraManifest(
+    s3_volume,
+    ttl=float(os.environ.get('LORA_MANIFEST_TTL', 300))
+)
+
+# Free VRAM kept in reserve when deciding whether a full VAE decode fits
+VRAM_HEADROOM_GB = float(os.environ.get('FLUX_VRAM_HEADROOM_GB', 1.5))
+
+# Most LoRA loaders chained in one graph
+MAX_LORAS = int(os.environ.get('FLUX_MAX_LORAS', 4))
 
 class FluxHandler:
     def __init__(self):
-        self.server_url = "http://localhost:8188"
+        self.server_url = comfy_client.server_url
         self.workflow_path = "/workflows/flux_actual.json"
         self.check_models()
         
-    def create_dynamic_lora_workflow(self, lora_name: str) -> Dict:
-        """Create a FLUX workflow with LoRA dynamically to bypass validation"""
-        return {
-            "6": {
-                "inputs": {
-                    "text": "a beautiful landscape",
-                    "clip": ["38", 0]
-                },
-                "class_type": "CLIPTextEncode",
-                "_meta": {"title": "CLIP Text Encode (Positive Prompt)"}
-            },
-            "8": {
-                "inputs": {
-                    "samples": ["31", 0],
-                    "vae": ["39", 0]
-                },
-                "class_type": "VAEDecode",
-                "_meta": {"title": "VAE Decode"}
-            },
-            "31": {
-                "inputs": {
-                    "seed": 0,
-                    "steps": 20,
-                    "cfg": 1,
-                    "sampler_name": "euler",
-                    "scheduler": "simple",
-                    "denoise": 1,
-                    "model": ["40", 0],
-                    "positive": ["35", 0],
-                    "negative": ["135", 0],
-                    "latent_image": ["124", 0]
-                },
-                "class_type": "KSampler",
-                "_meta": {"title": "KSampler"}
-            },
-            "35": {
-                "inputs": {
-                    "guidance": 2.5,
-                    "conditioning": ["6", 0]
-                },
-                "class_type": "FluxGuidance",
-                "_meta": {"title": "FLUX Guidance"}
-            },
-            "37": {
-                "inputs": {
-                    "unet_name": "flux1-dev-kontext_fp8_scaled.safetensors",
-                    "weight_dtype": "default"
-                },
-                "class_type": "UNETLoader",
-                "_meta": {"title": "Load Diffusion Model"}
-            },
-            "38": {
-                "inputs": {
-                    "clip_name1": "t5xxl_fp16.safetensors",
-                    "clip_name2": "clip_l.safetensors",
-                    "type": "flux",
-                    "device": "default"
-                },
-                "class_type": "DualCLIPLoader",
-                "_meta": {"title": "Dual CLIP Load"}
-            },
-            "39": {
-                "inputs": {
-                    "vae_name": "ae.safetensors"
-                },
-                "class_type": "VAELoader",
-                "_meta": {"title": "VAE Load"}
-            },
-            "40": {
-                "inputs": {
-                    "lora_name": lora_name,
-                    "strength_model": 0.8,
-                    "model": ["37", 0]
-                },
-                "class_type": "LoraLoaderModelOnly",
-                "_meta": {"title": "LoRA Loader (Model Only)"}
-            },
-            "124": {
-                "inputs": {
-                    "width": 1024,
-                    "height": 1024,
-                    "batch_size": 1
-                },
-                "class_type": "EmptyLatentImage",
-                "_meta": {"title": "Empty Latent Image"}
-            },
-            "135": {
-                "inputs": {
-                    "conditioning": ["6", 0]
-                },
-                "class_type": "ConditioningZeroOut",
-                "_meta": {"title": "Conditioning Zero Out"}
-            },
-            "136": {
-                "inputs": {
-                    "filename_prefix": "ComfyUI_LoRA",
-                    "images": ["8", 0]
-                },
-                "class_type": "SaveImage",
-                "_meta": {"title": "Save Image"}
-            }
-        }
+    def workflow_name(self, is_img2img: bool = False) -> str:
+        """Template used for the job mode"""
+        return "flux_img2img" if is_img2img else "flux_actual"
+    
+    def load_workflow(self, is_img2img: bool = False, loras: list = None) -> Dict:
+        """Load the FLUX workflow template, with the LoRA stack spliced in after the UNET"""
+        workflow_name = self.workflow_name(is_img2img)
+        logger.info(f"Using {'image-to-image' if is_img2img else 'text-to-image'} workflow")
 
-    def load_workflow(self, is_img2img: bool = False, lora_name: str = None) -> Dict:
-        """Load the FLUX workflow template"""
-        # If LoRA is requested, create workflow dynamically to bypass validation
-        if lora_name:
-            logger.info(f"Creating dynamic LoRA workflow for: {lora_name}")
-            return self.create_dynamic_lora_workflow(lora_name)
-            
-        # Try multiple possible paths for workflows
-        workflow_paths = [
-            "/workflows/",
-            "/src/workflows/",
-            "/app/workflows/",
-            "./workflows/",
-            "workflows/"
-        ]
-        
-        # Determine which workflow to use
-        if is_img2img:
-            logger.info("Using image-to-image workflow")
-            workflow_filename = "flux_img2img.json"
-        else:
-            logger.info("Using text-to-image workflow")
-            workflow_filename = "flux_actual.json"
-            
-        # Find the workflow file
-        workflow_file = None
-        for path in workflow_paths:
-            test_path = os.path.join(path, workflow_filename)
-            if os.path.exists(test_path):
-                workflow_file = test_path
-                logger.info(f"Found workflow at: {test_path}")
-                break
-                
-        if not workflow_file:
-            # If no workflow found, try to construct path based on current file location
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            workflow_file = os.path.join(current_dir, "workflows", workflow_filename)
-            if not os.path.exists(workflow_file):
-                logger.error(f"Could not find workflow file: {workflow_filename}")
-                raise FileNotFoundError(f"Workflow file not found: {workflow_filename}")
-            
-        with open(workflow_file, 'r') as f:
-            return json.load(f)
+        # Templates are cached in memory; only mutated nodes are copied per job
+        workflow = workflow_registry.instantiate(workflow_name)
+        if loras:
+            # Same canonical loader subgraph with or without LoRAs, so ComfyUI keeps it cached
+            logger.info(f"Adding LoRA chain: {', '.join(l['name'] for l in loras)}")
+            add_lora_chain(workflow, loras)
+        return workflow
     
-    def update_prompt(self, workflow: Dict, prompt: str, width: int = 1024, height: int = 1024, image_data: bytes = None, lora_name: str = None, lora_strength: float = 1.0) -> Dict:
+    def update_prompt(self, workflow: WorkflowInstance, prompt: str, width: int = 1024, height: int = 1024, image_name: str = None, batch_size: int = 1, seed: int = None) -> Dict:
         """Update workflow with user prompt and dimensions"""
         
-        # Find and update prompt node
-        for node_id, node in workflow.items():
-            # Handle both FLUX and standard CLIP encoding
-            if node.get("class_type") in ["CLIPTextEncodeFlux", "CLIPTextEncode"]:
-                if "text" in node["inputs"]:
-                    # Only update if it's the positive prompt (not negative)
-                    if node.get("_meta", {}).get("title", "").lower().find("negative") == -1:
-                        node["inputs"]["text"] = prompt
-                        if "guidance" in node["inputs"]:
-                            node["inputs"]["guidance"] = 3.5
-            
-            # Update dimensions
-            elif node.get("class_type") == "EmptyLatentImage":
-                node["inputs"]["width"] = width
-                node["inputs"]["height"] = height
-            
-            # Update seed with random value if it's 0
-            elif node.get("class_type") == "KSampler":
-                if node["inputs"].get("seed", 0) == 0:
-                    node["inputs"]["seed"] = random.randint(1, 2**32 - 1)
+        roles = workflow.roles
+
+        # Positive prompt (FLUX and standard CLIP encoders)
+        for node_id in roles.positive_prompt:
+            node = workflow.edit(node_id)
+            node["inputs"]["text"] = prompt
+            if "guidance" in node["inputs"]:
+                node["inputs"]["guidance"] = 3.5
+
+        # Update dimensions (one batched latent for multiple images)
+        workflow.set_inputs("latent", width=width, height=height, batch_size=batch_size)
+
+        # Pinned seed (0 included), or a random value where the template seed is 0
+        if seed is not None:
+            workflow.set_seed(seed)
+        else:
+            workflow.set_seed(random.randint(1, 2**32 - 1), only_if_zero=True)
         
         # Handle image input for image-to-image
-        if image_data:
-            # Save image temporarily
-            temp_image = f"/tmp/input_{uuid.uuid4()}.png"
-            with open(temp_image, 'wb') as f:
-                f.write(image_data)
-            
-            # Update LoadImage node if it exists
-            for node_id, node in workflow.items():
-                if node.get("class_type") == "LoadImage":
-                    node["inputs"]["image"] = temp_image
-                    
-                # Switch KSampler to use VAEEncode instead of EmptyLatentImage
-                elif node.get("class_type") == "KSampler":
-                    # Find VAEEncode node
-                    vae_encode_id = None
-                    for nid, n in workflow.items():
-                        if n.get("class_type") == "VAEEncode":
-                            vae_encode_id = nid
-                            break
-                    if vae_encode_id:
-                        node["inputs"]["latent_image"] = [vae_encode_id, 0]
-        
-        # Update LoRA if specified
-        if lora_name:
-            # Only update LoRA strength if using dynamic workflow (name is already set)
-            # For dynamic workflows, only update the strength
-            for node_id, node in workflow.items():
-                if node.get("class_type") in ["LoraLoader", "LoraLoaderModelOnly"]:
-                    # Check if this is a dynamically created workflow (lora_name already set)
-                    if "lora_name" in node["inputs"] and node["inputs"]["lora_name"]:
-                        # Only update strength for dynamic workflows
-                        node["inputs"]["strength_model"] = lora_strength
-                        if "strength_clip" in node["inputs"]:
-                            node["inputs"]["strength_clip"] = lora_strength
-                        logger.info(f"Updated LoRA strength in node {node_id} to {lora_strength}")
-                    else:
-                        # This shouldn't happen with dynamic workflows, but keep as fallback
-                        logger.warn("LoRA node found but name not set in dynamic workflow")
+        if image_name:
+            # Update LoadImage node if it exists (image already uploaded to ComfyUI)
+            workflow.set_inputs("load_image", image=image_name)
+
+            # Switch KSampler to use VAEEncode instead of EmptyLatentImage
+            vae_encode_id = roles.first("vae_encode")
+            if vae_encode_id:
+                latent_source = [vae_encode_id, 0]
+                if batch_size > 1:
+                    # The encoded input is a single latent; repeat it for the batch
+                    workflow["batch_repeat"] = {
+                        "class_type": "RepeatLatentBatch",
+                        "inputs": {"samples": latent_source, "amount": batch_size}
+                    }
+                    latent_source = ["batch_repeat", 0]
+                workflow.set_inputs("sampler", latent_image=latent_source)
         
         return workflow
     
@@ -424,18 +327,19 @@ class FluxHandler:
             else:
                 logger.debug(f"Directory not found: {dir_path}")
     
-    def queue_prompt(self, workflow: Dict) -> str:
+    def queue_prompt(self, workflow: WorkflowInstance) -> str:
         """Queue workflow and return prompt ID"""
-        p = {"prompt": workflow}
         logger.debug(f"Queueing prompt to {self.server_url}/prompt")
         
         # Log LoRA information for debugging
-        for node_id, node in workflow.items():
-            if node.get("class_type") in ["LoraLoader", "LoraLoaderModelOnly"]:
-                logger.info(f"LoRA node {node_id} config: {node['inputs']}")
+        for node_id in workflow.roles.lora_chain:
+            logger.info(f"LoRA node {node_id} config: {dict(workflow[node_id]['inputs'])}")
         
+        # Track the prompt before it is queued so none of its events are missed
+        requested_id = str(uuid.uuid4())
+        event_stream.track(requested_id)
         try:
-            response = requests.post(f"{self.server_url}/prompt", json=p)
+            response = comfy_client.queue_prompt(workflow, client_id=event_stream.client_id, prompt_id=requested_id)
             
             # Log response for debugging validation errors
             if response.status_code != 200:
@@ -447,8 +351,18 @@ class FluxHandler:
             if 'prompt_id' not in result:
                 logger.error(f"No prompt_id in response: {result}")
                 raise ValueError(f"Invalid response from ComfyUI: {result}")
-            return result['prompt_id']
+            prompt_id = result['prompt_id']
+            if prompt_id != requested_id:
+                # Older ComfyUI assigned its own ID; catch a prompt that already finished
+                event_stream.forget(requested_id)
+                event_stream.track(prompt_id)
+                try:
+                    event_stream.poll_history(prompt_id)
+                except Exception as e:
+                    logger.debug(f"History check for {prompt_id} failed: {e}")
+            return prompt_id
         except requests.exceptions.HTTPError as e:
+            event_stream.forget(requested_id)
             logger.error(f"HTTP Error {e.response.status_code}: {e.response.text}")
             # Try to parse error details
             try:
@@ -461,133 +375,222 @@ class FluxHandler:
                 pass
             raise
         except Exception as e:
+            event_stream.forget(requested_id)
             logger.error(f"Failed to queue prompt: {str(e)}")
             raise
     
-    def wait_for_image(self, prompt_id: str, timeout: int = 600) -> bytes:
-        """Wait for and retrieve generated image"""
-        start_time = time.time()
-        
-        last_log_time = start_time
-        while time.time() - start_time < timeout:
-            # Log progress every 30 seconds
-            if time.time() - last_log_time > 30:
-                elapsed = int(time.time() - start_time)
-                logger.info(f"Still waiting for image... {elapsed}s elapsed")
-                last_log_time = time.time()
-                
-            # Check queue status first
-            queue_response = requests.get(f"{self.server_url}/queue")
-            queue_data = queue_response.json()
-            
-            # Log if our prompt is still in queue
-            if queue_data.get('queue_running'):
-                for item in queue_data['queue_running']:
-                    if item[1] == prompt_id:
-                        logger.debug(f"Prompt {prompt_id} is currently being processed")
-                        
-            # Check history
-            response = requests.get(f"{self.server_url}/history/{prompt_id}")
-            history = response.json()
-            
-            if prompt_id in history:
-                outputs = history[prompt_id].get('outputs', {})
-                
-                # Find image in outputs
-                for node_id, node_output in outputs.items():
-                    if 'images' in node_output and len(node_output['images']) > 0:
-                        image = node_output['images'][0]
-                        
-                        # Fetch image data
-                        image_data = requests.get(
-                            f"{self.server_url}/view",
-                            params={
-                                'filename': image['filename'],
-                                'subfolder': image.get('subfolder', ''),
-                                'type': image.get('type', 'output')
-                            }
-                        ).content
-                        
-                        return image_data
-            
-            time.sleep(1)
+    def wait_for_images(self, prompt_id: str, workflow: WorkflowInstance = None, timeout: int = 600, on_event=None, cancel: CancelToken = None) -> list:
+        """Wait for the SaveImage node to finish, returns its output image descriptors
         
-        raise TimeoutError("Image generation timed out")
+        on_event(event, data) receives progress and preview events while waiting.
+        On timeout or cancellation the prompt is withdrawn from ComfyUI and
+        JobCancelled is raised with what was reclaimed.
+        """
+        if workflow:
+            state = event_stream.expect(prompt_id, workflow.roles.save_image)
+            if on_event:
+                state.listeners.append(on_event)
+
+        try:
+            try:
+                state = event_stream.wait(prompt_id, timeout=timeout, cancel=cancel)
+            except (TimeoutError, JobCancelled) as e:
+                if isinstance(e, JobCancelled):
+                    reason = e.reason
+                else:
+                    # A wait capped by the job deadline times out as the deadline
+                    reason = cancel.reason if cancel is not None and cancel.cancelled else "timeout"
+                raise JobCancelled(reason, self.withdraw_prompt(prompt_id)) from e
+            images = state.images
+            if not images:
+                raise ValueError(f"No images in outputs for prompt {prompt_id}")
+            logger.debug(f"Prompt {prompt_id} completed via {state.source}")
+            spans = current_spans()
+            if spans:
+                for stage, seconds in state.timings().items():
+                    spans.add(stage, seconds)
+                if workflow:
+                    # Loader reuse shows up as execution_cached nodes
+                    spans.note("node_cache", cache_report(workflow, state.cached_nodes, state.executed_nodes))
+            return images
+        finally:
+            event_stream.forget(prompt_id)
     
-    def upload_to_r2(self, image_data: bytes, job_id: str) -> str:
-        """Upload to R2 and return URL"""
-        if not s3_client:
-            # No R2 configured, return base64
-            return base64.b64encode(image_data).decode('utf-8')
-        
-        key = f"flux/{job_id}/image.png"
-        s3_client.put_object(
-            Bucket=os.environ.get('R2_BUCKET'),
-            Key=key,
-            Body=image_data,
-            ContentType='image/png'
-        )
+    def withdraw_prompt(self, prompt_id: str) -> Dict:
+        """Free the GPU from an abandoned prompt, returns what was done and reclaimed"""
+        state = event_stream.state(prompt_id)
+        withdrawn = withdraw_prompt(comfy_client, prompt_id)
+        reclaimed = 0.0
+        if withdrawn["dequeued"]:
+            reclaimed = typical_execution_seconds()
+        elif withdrawn["interrupted"] and state:
+            step, steps = state.progress
+            if state.first_progress_at and step > 1 and steps:
+                # Remaining sampler steps at the observed step rate
+                per_step = (state.last_progress_at - state.first_progress_at) / (step - 1)
+                reclaimed = per_step * max(0, steps - step)
+            elif state.started_at:
+                reclaimed = max(0.0, typical_execution_seconds() - (time.time() - state.started_at))
+        cancel_watcher.record(withdrawn["interrupted"], withdrawn["dequeued"], reclaimed)
+        logger.info(f"Withdrew prompt {prompt_id}: {withdrawn}, ~{reclaimed:.1f} GPU-seconds reclaimed")
+        return dict(withdrawn, reclaimed_gpu_seconds=round(reclaimed, 1))
+    
+    def stream_output(self, image: Dict, job_id: str, output_format: str = "png", quality: int = None, index: int = None) -> Dict:
+        """Stream an output image from /view into R2 (or base64) without buffering it whole
         
-        base_url = os.environ.get('R2_PUBLIC_URL', '').rstrip('/')
-        return f"{base_url}/{key}"
+        PNG output at the default level is piped through untouched; other
+        formats (and PNG with png_compress_level) are read once, re-encoded
+        on the encoder pool and then sent.
+        """
+        start = time.time()
+        response = comfy_client.view(image, stream=True)
+        view_ms = round((time.time() - start) * 1000, 1)
+        try:
+            chunks = response.iter_content(chunk_size=CHUNK_SIZE)
+            encoding = {"format": "png", "encode_ms": 0.0}
+            fetch_ms = None
+            if output_format != "png" or quality is not None:
+                data = response.content
+                fetch_ms = round((time.time() - start) * 1000, 1)
+                encoded, encoding = encode_async(data, output_format, quality).result()
+                chunks = [encoded]
+            fmt = encoding["format"]
+            if s3_client:
+                suffix = "" if index is None else f"_{index}"
+                key = f"flux/{job_id}/image{suffix}.{extension(fmt)}"
+                result = stream_to_r2(s3_client, os.environ.get('R2_BUCKET'), key, chunks, content_type(fmt))
+                base_url = os.environ.get('R2_PUBLIC_URL', '').rstrip('/')
+                result["url"] = f"{base_url}/{result['key']}"
+            else:
+                result = stream_to_base64(chunks)
+        finally:
+            response.close()
+        result.update(encoding)
+        if image.get('type', 'output') == 'output':
+            # Delivered: the local copy is no longer needed
+            disk_gc.discard(os.path.join(COMFYUI_OUTPUT_DIR, image.get('subfolder', ''), image['filename']))
+        timings = result["timings"]
+        timings["view_ms"] = view_ms
+        if fetch_ms is None:
+            # PNG: the /view read overlaps the upload
+            fetch_ms = view_ms + timings.get("read_ms", timings["total_ms"])
+            upload_ms = timings.get("upload_tail_ms")
+        else:
+            upload_ms = timings["total_ms"] if s3_client else None
+        timings["fetch_ms"] = fetch_ms
+        if upload_ms is not None:
+            timings["upload_ms"] = upload_ms
+        logger.info(f"Delivered {result['bytes']} bytes in {result['timings']['total_ms']} ms")
+        return result
+    
+    def volume_lora_paths(self, lora_filename: str) -> list:
+        """LoRA locations outside the local cache (persistent volume first)"""
+        return [
+            f"/runpod-volume/ComfyUI/models/loras/{lora_filename}",
+            f"/workspace/ComfyUI/models/loras/{lora_filename}"
+        ]
     
     def check_lora_in_s3(self, lora_filename: str) -> bool:
-        """Check if LoRA exists in S3 volume"""
-        if not s3_volume_client:
+        """Check if LoRA exists in S3 volume (answered from the manifest)"""
+        if not s3_volume.available():
             return False
         
-        try:
-            key = f"ComfyUI/models/loras/{lora_filename}"
-            s3_volume_client.head_object(
-                Bucket=s3_credentials.get('S3_BUCKET'),
-                Key=key
-            )
-            logger.info(f"LoRA found in S3: {key}")
+        with span("lora_head"):
+            found = lora_manifest.contains(lora_filename)
+        if found:
+            logger.info(f"LoRA found in S3: {lora_filename}")
             return True
+        logger.debug(f"LoRA not found in S3: {lora_filename}")
+        return False
+    
+    def probe_lora(self, lora_filename: str, lora_url: str = None, local_path: str = None) -> Optional[Dict]:
+        """Classify a LoRA from its safetensors header without downloading it
+        
+        Prefers the summary cached in the manifest, then a local file, then
+        range reads against S3 or the download URL. Returns None if the
+        header could not be read.
+        """
+        entry = lora_manifest.get(lora_filename)
+        if entry and entry.get('header'):
+            return entry['header']
+        
+        try:
+            with span("lora_probe"):
+                if local_path:
+                    summary = classify(read_header_file(local_path))
+                elif entry:
+                    key = f"ComfyUI/models/loras/{lora_filename}"
+                    summary = classify(read_header(S3Source(s3_volume.client, s3_volume.bucket, key)))
+                elif lora_url:
+                    summary = classify(read_header(HttpSource(lora_url)))
+                else:
+                    return None
         except Exception as e:
-            logger.debug(f"LoRA not found in S3: {lora_filename}")
-            return False
+            logger.warn(f"Could not read safetensors header for {lora_filename}: {e}")
+            return None
+        
+        logger.info(f"LoRA {lora_filename}: {summary['arch']} (rank {summary['rank']}, {summary['tensors']} tensors)")
+        if entry:
+            lora_manifest.update(lora_filename, header=summary)
+        return summary
     
-    def download_lora_from_s3(self, lora_filename: str, local_path: str) -> bool:
-        """Download LoRA from S3 to local path"""
-        if not s3_volume_client:
-            return False
+    def download_lora_from_s3(self, lora_filename: str, local_path: str) -> Optional[Dict]:
+        """Download LoRA from S3 to local path, returns throughput stats"""
+        if not s3_volume.available():
+            return None
         
         try:
             key = f"ComfyUI/models/loras/{lora_filename}"
             logger.info(f"Downloading LoRA from S3: {key} to {local_path}")
             
-            os.makedirs(os.path.dirname(local_path), exist_ok=True)
-            s3_volume_client.download_file(
-                Bucket=s3_credentials.get('S3_BUCKET'),
-                Key=key,
-                Filename=local_path
-            )
+            entry = lora_manifest.get(lora_filename)
+            with span("lora_download"):
+                stats = download(
+                    S3Source(s3_volume.client, s3_volume.bucket, key),
+                    local_path,
+                    expected_sha256=(entry or {}).get('sha256')
+                )
             
-            file_size = os.path.getsize(local_path) / (1024 * 1024)  # MB
-            logger.info(f"Successfully downloaded LoRA from S3 ({file_size:.1f} MB)")
-            return True
+            file_size = stats['bytes'] / (1024 * 1024)  # MB
+            logger.info(f"Successfully downloaded LoRA from S3 ({file_size:.1f} MB, {stats['parts']} parts, {stats['mb_per_s']} MB/s)")
+            return stats
         except Exception as e:
             logger.error(f"Failed to download LoRA from S3: {e}")
-            return False
+            return None
     
     def upload_lora_to_s3(self, local_path: str, lora_filename: str) -> bool:
         """Upload LoRA to S3 volume"""
-        if not s3_volume_client:
+        if not s3_volume.available():
             return False
         
         try:
             key = f"ComfyUI/models/loras/{lora_filename}"
             logger.info(f"Uploading LoRA to S3: {local_path} -> {key}")
             
-            with open(local_path, 'rb') as f:
-                s3_volume_client.put_object(
-                    Bucket=s3_credentials.get('S3_BUCKET'),
+            try:
+                header = classify(read_header_file(local_path))
+            except Exception:
+                header = None
+            sha256 = hashlib.sha256()
+            with span("lora_upload"), open(local_path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    sha256.update(block)
+                f.seek(0)
+                response = s3_volume.client.put_object(
+                    Bucket=s3_volume.bucket,
                     Key=key,
                     Body=f,
                     ContentType='application/octet-stream'
                 )
             
+            lora_manifest.record(
+                lora_filename,
+                os.path.getsize(local_path),
+                response.get('ETag', ''),
+                sha256=sha256.hexdigest(),
+                header=header
+            )
+            lora_manifest.schedule_save()
             logger.info(f"Successfully uploaded LoRA to S3: {key}")
             return True
         except Exception as e:
@@ -596,21 +599,308 @@ class FluxHandler:
 
 handler = FluxHandler()
 
-def runpod_handler(job):
+# Result fields stored in the result cache (per-worker stats are left out)
+CACHED_RESULT_FIELDS = ("status", "model", "seed", "image_url", "image_urls", "output", "outputs")
+
+# Largest num_images per job and concurrent /view -> R2 transfers
+MAX_BATCH_SIZE = int(os.environ.get('FLUX_MAX_BATCH', 4))
+OUTPUT_WORKERS = 4
+
+def lora_rejection(lora_filename: str, summary: Optional[Dict]) -> Optional[Dict]:
+    """Error response for a LoRA whose header identifies a non-FLUX base model"""
+    if is_compatible(summary, "flux"):
+        return None
+    logger.warn(f"Rejecting {summary['arch']} LoRA {lora_filename}: not compatible with FLUX")
+    return {
+        "status": "error",
+        "error": f"LoRA {lora_filename} was trained for {summary['arch']}, not FLUX (see IMPORTANT_LORA_INCOMPATIBILITY.md)",
+        "lora_header": summary
+    }
+
+def lora_filename(name: str) -> str:
+    return name if name.endswith('.safetensors') else f"{name}.safetensors"
+
+def lora_specs(job_input: Dict) -> list:
+    """Requested LoRA stack as [{name, strength, url}]
+    
+    Takes "loras": [{"name", "strength", "url"}] or the single-LoRA
+    lora_name / lora_strength / lora_url fields. Raises ValueError on bad input.
+    """
+    loras = job_input.get('loras')
+    if loras is None:
+        if not job_input.get('lora_name'):
+            return []
+        loras = [{
+            "name": job_input['lora_name'],
+            "strength": job_input.get('lora_strength', 1.0),
+            "url": job_input.get('lora_url')
+        }]
+    if not isinstance(loras, list):
+        raise ValueError("loras must be a list of {name, strength}")
+    if len(loras) > MAX_LORAS:
+        raise ValueError(f"At most {MAX_LORAS} LoRAs can be stacked")
+    
+    specs = []
+    for lora in loras:
+        if isinstance(lora, str):
+            lora = {"name": lora}
+        if not isinstance(lora, dict) or not lora.get('name'):
+            raise ValueError("Each LoRA needs a name")
+        name = lora_filename(lora['name'])
+        if any(spec['name'] == name for spec in specs):
+            raise ValueError(f"LoRA {name} is listed more than once")
+        specs.append({
+            "name": name,
+            "strength": float(lora.get('strength', 1.0)),
+            "url": lora.get('url')
+        })
+    return specs
+
+def resolve_lora(spec: Dict) -> Dict:
+    """Make one requested LoRA available in the local cache
+    
+    Returns the spec with status "ready", "missing" or "rejected", where it
+    came from, and the download stats if it had to be fetched.
+    """
+    name = spec['name']
+    resolved = {"name": name, "strength": spec['strength'], "status": "missing", "source": None}
+    download_stats = None
+    
+    # Check the local cache and volume paths first
+    local_path = lora_cache.lookup(name, handler.volume_lora_paths(name))
+    if local_path:
+        resolved["source"] = "local"
+        # Probe the file; S3 and URL sources are probed before downloading
+        rejection = lora_rejection(name, handler.probe_lora(name, local_path=local_path))
+        if rejection:
+            return dict(resolved, status="rejected", rejection=rejection)
+    elif spec.get('url'):
+        # Two small range reads instead of a full download for incompatible LoRAs
+        rejection = lora_rejection(name, handler.probe_lora(name, lora_url=spec['url']))
+        if rejection:
+            return dict(resolved, status="rejected", rejection=rejection)
+        
+        logger.info(f"Downloading custom LoRA: {name}")
+        def fetch(tmp_path):
+            nonlocal download_stats
+            with span("lora_download"):
+                download_stats = download(HttpSource(spec['url']), tmp_path)
+        
+        # Known size up front lets the cache evict before the download lands
+        # (the URL, not the bucket copy, is what gets downloaded)
+        expected_size = None
+        try:
+            expected_size = HttpSource(spec['url']).describe()[0]
+        except Exception as e:
+            logger.debug(f"Could not size {name} before downloading: {e}")
+        local_path = lora_cache.install(name, fetch, expected_size)
+        if local_path:
+            resolved["source"] = "url"
+            # Upload to S3 if download was successful
+            handler.upload_lora_to_s3(local_path, name)
+        else:
+            logger.error(f"Failed to download LoRA from {spec['url']}")
+    elif handler.check_lora_in_s3(name):
+        rejection = lora_rejection(name, handler.probe_lora(name))
+        if rejection:
+            return dict(resolved, status="rejected", rejection=rejection)
+        
+        # Download from S3 into the local cache
+        def fetch(tmp_path):
+            nonlocal download_stats
+            download_stats = handler.download_lora_from_s3(name, tmp_path)
+            return bool(download_stats)
+        
+        local_path = lora_cache.install(name, fetch, (lora_manifest.get(name) or {}).get('size'))
+        if local_path:
+            resolved["source"] = "s3"
+    
+    if download_stats:
+        resolved["download"] = download_stats
+    if not local_path:
+        logger.warn(f"LoRA {name} not found or invalid, leaving it out")
+        return resolved
+    
+    file_size = os.path.getsize(local_path) / (1024 * 1024)  # MB
+    if file_size <= 0.1:
+        logger.warn(f"LoRA {name} at {local_path} is too small ({file_size:.2f} MB), leaving it out")
+        return resolved
+    logger.info(f"Valid LoRA found at {local_path} ({file_size:.1f} MB)")
+    
+    # Upload to S3 if not already there (skipped while credentials are still resolving)
+    if resolved["source"] == "local" and s3_volume.available(wait=0) and not handler.check_lora_in_s3(name):
+        handler.upload_lora_to_s3(local_path, name)
+    resolved["status"] = "ready"
+    return resolved
+
+def lora_version(spec: Dict) -> Optional[str]:
+    """What identifies a LoRA's contents for the result cache, None if unknown
+    
+    The S3 manifest's sha256/ETag when the LoRA is in the bucket, otherwise
+    the size and mtime of a local copy, otherwise its download URL.
+    """
+    entry = lora_manifest.get(spec['name']) or {}
+    if entry.get('sha256') or entry.get('etag'):
+        return entry.get('sha256') or entry.get('etag')
+    for path in [lora_cache.path(spec['name']), *handler.volume_lora_paths(spec['name'])]:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+    return spec.get('url')
+
+def resolve_loras(specs: list) -> list:
+    """Resolve a LoRA stack concurrently, in request order"""
+    if not specs:
+        return []
+    with ThreadPoolExecutor(max_workers=len(specs)) as pool:
+        # Each worker gets a copy of the job context so its spans land on this job
+        futures = [pool.submit(contextvars.copy_context().run, resolve_lora, spec) for spec in specs]
+        return [future.result() for future in futures]
+
+def volume_lora_path(lora_name: str) -> str:
+    return f"/runpod-volume/ComfyUI/models/loras/{lora_name}"
+
+def existing_volume_lora(lora_name: str, finished_after: float) -> Optional[Dict]:
+    """download_lora result for a LoRA another worker finished while we waited, else None
+    
+    Files older than finished_after are not adopted, so a repeated
+    download_lora still replaces a LoRA re-uploaded under the same name.
+    """
+    local_path = volume_lora_path(lora_name)
+    try:
+        stat = os.stat(local_path)
+    except OSError:
+        return None
+    if stat.st_size <= 0 or stat.st_mtime < finished_after:
+        return None
+    logger.info(f"LoRA {lora_name} was downloaded by another worker while waiting")
+    return {
+        "status": "success",
+        "message": "LoRA downloaded by a concurrent request",
+        "path": local_path,
+        "size_mb": round(stat.st_size / (1024 * 1024), 2),
+        "s3_uploaded": None,
+        "download": None
+    }
+
+def download_lora_to_volume(lora_url: str, lora_name: str) -> Dict:
+    """download_lora action body; runs once per LoRA name at a time"""
+    # Download next to the target (same filesystem) so the final rename is atomic
+    local_path = volume_lora_path(lora_name)
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+    temp_path = f"{local_path}.{uuid.uuid4().hex}.part"
+
+    # Parallel ranged download
+    try:
+        download_stats = download(HttpSource(lora_url), temp_path)
+    except Exception as e:
+        logger.error(f"Failed to download LoRA: {e}")
+        return {"status": "error", "error": f"Download failed: {e}"}
+
+    logger.info(f"LoRA downloaded successfully to {temp_path} ({download_stats['mb_per_s']} MB/s)")
+    # Check file size
+    size = os.path.getsize(temp_path) / (1024 * 1024)  # MB
+
+    # Upload to S3 volume if configured
+    if handler.upload_lora_to_s3(temp_path, lora_name):
+        logger.info(f"LoRA uploaded to S3 volume")
+        s3_uploaded = True
+    else:
+        s3_uploaded = False
+        logger.warn("S3 upload failed or not configured")
+
+    os.replace(temp_path, local_path)
+
+    return {
+        "status": "success",
+        "message": f"LoRA downloaded successfully",
+        "path": local_path,
+        "size_mb": round(size, 2),
+        "s3_uploaded": s3_uploaded,
+        "download": download_stats
+    }
+
+def typical_execution_seconds() -> float:
+    """Median ComfyUI execution time of this worker's recent jobs (0 without history)"""
+    execution = aggregate(metrics_log.records()).get("execution")
+    return execution["p50"] / 1000 if execution else 0.0
+
+def record_job_timings(job, spans: SpanRecorder, status: str, **fields) -> Dict:
+    """Finish a job's timings, append them to the metrics log and return them"""
+    timings = spans.to_dict()
+    try:
+        # Worker startup (ComfyUI boot, warm-up) is reported once, on the first job
+        timings["cold_start"] = cold_start_timings.pop()
+    except IndexError:
+        pass
+    metrics_log.append(dict(fields, job_id=job.get('id'), status=status, timings=spans.to_dict()))
+    return timings
+
+# Upper bound on preview frames streamed for one job
+MAX_PREVIEWS = int(os.environ.get('FLUX_MAX_PREVIEWS', 20))
+
+def job_event_listener(emit, preview_interval: float = 0):
+    """Translate ComfyUI progress/preview events into streamed job events"""
+    last_preview = [0.0]
+    previews = [0]
+    
+    def on_event(event: str, data: Dict):
+        if event == 'progress':
+            emit({"event": "progress", "step": data['step'], "steps": data['steps']})
+        elif event == 'preview' and preview_interval > 0 and previews[0] < MAX_PREVIEWS:
+            now = time.time()
+            if now - last_preview[0] >= preview_interval:
+                last_preview[0] = now
+                previews[0] += 1
+                emit({
+                    "event": "preview",
+                    "format": data['format'],
+                    "image": base64.b64encode(data['image']).decode('utf-8')
+                })
+    return on_event
+
+def runpod_handler(job, emit=None, cancel=None):
     """
     FLUX handler supporting both text-to-image and image-to-image
     Input format:
     {
         "input": {
             "prompt": "a beautiful landscape",
-            "width": 1024,
+            "width": 1024,  # width/height are snapped to the nearest 64-pixel aspect bucket
             "height": 1024,
-            "image": "base64_encoded_image"  # optional, for img2img
+            "image": "base64_encoded_image",  # optional, for img2img
+            "num_images": 1,  # optional, 1-FLUX_MAX_BATCH images from one batched latent
+            "preview_interval": 0,  # optional, seconds between preview frames on /stream (FLUX_STREAM_EVENTS, 0 = off)
+            "seed": 42,  # optional, pins the seed; pinned jobs are served from the result cache
+            "loras": [{"name": "mix4", "strength": 0.8, "url": null}],  # optional, stacked in one graph
+            "bypass_cache": false,  # optional, always generate
+            "deadline": 1760000000  # optional, unix time after which the job is abandoned (or "timeout": seconds)
         }
     }
+    
+    emit(event), if given, receives progress events while the job runs.
+    cancel, if given, is a CancelToken the caller can trip to abandon the job.
     """
+    streaming = emit is not None
+    emit = emit or (lambda event: None)
+    job_input = job.get('input') or {}
+    if job_input.get('action') == 'metrics':
+        # p50/p95 per stage for the backend; scope "volume" covers every worker
+        return {
+            "status": "success",
+            "metrics": metrics_log.summary(job_input.get('scope', 'volume'), float(job_input.get('since', 0)))
+        }
+    
+    spans = begin_job()
+    input_digest = None
+    held_loras = []
+    cancel = cancel or CancelToken()
+    cancel_watcher.watch(job.get('id'), cancel)
     try:
         job_input = job['input']
+        cancel.deadline = deadline_from_input(job_input)
         
         # Check for special actions
         action = job_input.get('action')
@@ -622,225 +912,339 @@ def runpod_handler(job):
             if not lora_url:
                 return {"status": "error", "error": "No LoRA URL provided"}
             
-            logger.info(f"Downloading LoRA: {lora_name} from {lora_url}")
+            rejection = lora_rejection(lora_name, handler.probe_lora(lora_name, lora_url=lora_url))
+            if rejection:
+                return rejection
             
-            # Download to temporary location first
-            temp_path = f"/tmp/{lora_name}"
-            
-            # Use wget to download
-            cmd = ['wget', '-O', temp_path, lora_url]
-            result = subprocess.run(cmd, capture_output=True, text=True)
+            logger.info(f"Downloading LoRA: {lora_name} from {lora_url}")
             
-            if result.returncode == 0:
-                logger.info(f"LoRA downloaded successfully to {temp_path}")
-                # Check file size
-                size = os.path.getsize(temp_path) / (1024 * 1024)  # MB
-                
-                # Upload to S3 volume if configured
-                if s3_volume_client and handler.upload_lora_to_s3(temp_path, lora_name):
-                    logger.info(f"LoRA uploaded to S3 volume")
-                    s3_uploaded = True
-                else:
-                    s3_uploaded = False
-                    logger.warn("S3 upload failed or not configured")
-                
-                # Copy to S3 volume path for persistence
-                local_path = f"/runpod-volume/ComfyUI/models/loras/{lora_name}"
-                os.makedirs(os.path.dirname(local_path), exist_ok=True)
-                os.rename(temp_path, local_path)
-                
-                return {
-                    "status": "success",
-                    "message": f"LoRA downloaded successfully",
-                    "path": local_path,
-                    "size_mb": round(size, 2),
-                    "s3_uploaded": s3_uploaded
-                }
-            else:
-                logger.error(f"Failed to download LoRA: {result.stderr}")
-                return {"status": "error", "error": f"Download failed: {result.stderr}"}
+            # "overwrite": true always downloads, even if another worker just finished
+            requested_at = time.time()
+            return volume_lora_flights.do(
+                lora_name,
+                lambda: download_lora_to_volume(lora_url, lora_name),
+                check=None if job_input.get('overwrite') else lambda: existing_volume_lora(lora_name, requested_at)
+            )
         
-        # Normal image generation
+        # Normal image generation (waits out an in-progress ComfyUI restart)
+        with span("comfyui_ready"):
+            supervisor.wait_ready()
         prompt = job_input.get('prompt', 'a beautiful landscape')
-        width = job_input.get('width', 1024)
-        height = job_input.get('height', 1024)
+        output_format, output_quality = output_options(job_input)
+        seed = job_input.get('seed')
+        seed = int(seed) if seed is not None else None
+        if seed == -1:
+            seed = None
+        batch_size = int(job_input.get('num_images', job_input.get('batch_size', 1)))
+        if not 1 <= batch_size <= MAX_BATCH_SIZE:
+            return {"status": "error", "error": f"num_images must be between 1 and {MAX_BATCH_SIZE}"}
         
-        # LoRA parameters
-        lora_name = job_input.get('lora_name', None)
-        lora_strength = job_input.get('lora_strength', 1.0)
-        lora_url = job_input.get('lora_url', None)
+        # Snap to a supported bucket and decide on a tiled VAE decode before anything uses the size
+        resolution = plan_resolution(
+            job_input.get('width', 1024),
+            job_input.get('height', 1024),
+            batch_size,
+            free_vram_gb(),
+            headroom_gb=VRAM_HEADROOM_GB
+        )
+        width, height = resolution["width"], resolution["height"]
         
-        # Handle custom LoRA download if URL provided
-        if lora_url and lora_name:
-            logger.info(f"Custom LoRA URL provided: {lora_url}")
-            
-            # Ensure proper filename
-            if not lora_name.endswith('.safetensors'):
-                lora_filename = f"{lora_name}.safetensors"
-            else:
-                lora_filename = lora_name
-            
-            # Try to download the LoRA - prioritize S3 volume path
-            lora_paths = [
-                f"/runpod-volume/ComfyUI/models/loras/{lora_filename}",  # S3 volume (persistent)
-                f"/workspace/ComfyUI/models/loras/{lora_filename}",      # Workspace (temporary)
-                f"/ComfyUI/models/loras/{lora_filename}"                 # Local (temporary)
-            ]
-            
-            # Check if already exists
-            lora_exists = False
-            for path in lora_paths:
-                if os.path.exists(path):
-                    logger.info(f"LoRA already exists at: {path}")
-                    lora_exists = True
-                    break
-            
-            if not lora_exists:
-                logger.info(f"Downloading custom LoRA: {lora_filename}")
-                download_success = False
-                
-                for path in lora_paths:
-                    try:
-                        # Create directory if needed
-                        os.makedirs(os.path.dirname(path), exist_ok=True)
-                        
-                        # Download using urllib
-                        urllib.request.urlretrieve(lora_url, path)
-                        
-                        # Verify file size
-                        file_size = os.path.getsize(path) / (1024 * 1024)  # MB
-                        logger.info(f"Successfully downloaded {lora_filename} to {path} ({file_size:.1f} MB)")
-                        
-                        # Check if this is a FLUX-compatible LoRA
-                        # SD1.5 LoRAs are typically much smaller than FLUX LoRAs
-                        if file_size < 200:  # Less than 200MB is likely SD1.5
-                            logger.warn(f"LoRA file size ({file_size:.1f} MB) suggests SD1.5 LoRA, not FLUX-compatible")
-                            logger.warn("This LoRA may not work properly with FLUX")
-                            # Continue anyway but warn user
-                        
-                        download_success = True
-                        break
-                    except Exception as e:
-                        logger.warn(f"Could not download to {path}: {e}")
-                        # Clean up failed download
-                        if os.path.exists(path):
-                            os.remove(path)
-                
-                if not download_success:
-                    logger.error(f"Failed to download LoRA from {lora_url}")
-                    # Fall back to non-LoRA workflow
-                    logger.info("Falling back to standard workflow without LoRA")
-                    lora_name = None
-                else:
-                    # Upload to S3 if download was successful
-                    if s3_volume_client:
-                        for path in lora_paths:
-                            if os.path.exists(path):
-                                handler.upload_lora_to_s3(path, lora_filename)
-                                break
-            
+        # LoRA stack (a single lora_name is a stack of one)
+        loras = lora_specs(job_input)
         
-        # Check for image input (base64)
+        # Decode the input image (base64) up front: its digest is part of the cache key
         image_data = None
-        is_img2img = False
         if 'image' in job_input and job_input['image']:
             try:
-                image_data = base64.b64decode(job_input['image'])
-                is_img2img = True
-                logger.info("Image-to-image mode detected")
-            except Exception as e:
-                logger.warn(f"Failed to decode input image: {e}")
+                image_data = decode_base64_image(job_input['image'])
+            except ValueError as e:
+                # A bad image is the caller's error, not a reason to switch to txt2img
+                return {"status": "error", "error": f"Failed to decode input image: {e}"}
+        is_img2img = image_data is not None
+        
+        # Seed-pinned jobs are deterministic: reuse an earlier result before fetching or uploading anything
+        cache_key = None
+        if seed is not None and s3_client and not job_input.get('bypass_cache'):
+            with span("result_cache"):
+                lora_versions = [lora_version(spec) for spec in loras]
+                # A LoRA with no known version bypasses the cache: a replaced file would serve a stale image
+                if None not in lora_versions:
+                    cache_key = request_key(
+                        template=workflow_key(workflow_registry.template(handler.workflow_name(is_img2img)) or {}),
+                        prompt=prompt,
+                        width=width,
+                        height=height,
+                        batch_size=batch_size,
+                        seed=seed,
+                        tiled_decode=resolution["tiled_decode"],
+                        loras=[
+                            [spec["name"], spec["strength"], version]
+                            for spec, version in zip(loras, lora_versions)
+                        ],
+                        input_image=hashlib.sha256(image_data).hexdigest() if is_img2img else None,
+                        output_format=output_format,
+                        output_quality=output_quality
+                    )
+                cached = result_cache.get(cache_key) if cache_key else None
+            if cached:
+                logger.info(f"Result cache hit {cache_key[:12]}, skipping generation")
+                cached.update(
+                    cached=True,
+                    cache_key=cache_key,
+                    timings=record_job_timings(job, spans, "success", cached=True)
+                )
+                return cached
+        
+        # Fitted in memory, uploaded to ComfyUI without touching /tmp
+        image_name = None
+        if is_img2img:
+            with span("input_upload"):
+                image_name, input_digest = input_images.acquire(image_data, width, height)
+            logger.info("Image-to-image mode detected")
         
         # Log mode info
         mode_info = []
         if is_img2img:
             mode_info.append("img2img")
-        if lora_name:
-            mode_info.append(f"LoRA:{lora_name}")
+        if loras:
+            mode_info.append(f"LoRA:{'+'.join(spec['name'] for spec in loras)}")
         logger.info(f"Mode: {' + '.join(mode_info) if mode_info else 'txt2img'}")
         logger.info(f"Generating FLUX image: {prompt}")
-        logger.info(f"Dimensions: {width}x{height}")
+        logger.info(f"Dimensions: {width}x{height} (requested {resolution['requested'][0]}x{resolution['requested'][1]}, "
+                    f"~{resolution['vram_estimate']['peak_gb']} GB peak{', tiled decode' if resolution['tiled_decode'] else ''})")
         
-        # Validate LoRA exists before using LoRA workflow
-        use_lora = False
-        workflow_lora_name = None
-        
-        if lora_name:
-            lora_filename = f"{lora_name}.safetensors" if not lora_name.endswith('.safetensors') else lora_name
-            
-            # Check S3 first
-            if s3_volume_client and handler.check_lora_in_s3(lora_filename):
-                # Try to download from S3 to local workspace
-                local_path = f"/workspace/ComfyUI/models/loras/{lora_filename}"
-                if not os.path.exists(local_path):
-                    if handler.download_lora_from_s3(lora_filename, local_path):
-                        use_lora = True
-                        workflow_lora_name = lora_filename
-                        logger.info(f"LoRA downloaded from S3 and ready to use")
-                else:
-                    use_lora = True
-                    workflow_lora_name = lora_filename
-                    logger.info(f"LoRA already exists locally")
-            else:
-                # Check local paths
-                lora_paths = [
-                    f"/runpod-volume/ComfyUI/models/loras/{lora_filename}",  # Check S3 volume first
-                    f"/workspace/ComfyUI/models/loras/{lora_filename}",
-                    f"/ComfyUI/models/loras/{lora_filename}"
-                ]
-                
-                for path in lora_paths:
-                    if os.path.exists(path):
-                        file_size = os.path.getsize(path) / (1024 * 1024)  # MB
-                        if file_size > 0.1:  # Valid LoRA file
-                            use_lora = True
-                            workflow_lora_name = lora_filename
-                            logger.info(f"Valid LoRA found at {path} ({file_size:.1f} MB)")
-                            
-                            # Upload to S3 if not already there
-                            if s3_volume_client and not handler.check_lora_in_s3(lora_filename):
-                                handler.upload_lora_to_s3(path, lora_filename)
-                            break
-            
-            if not use_lora:
-                logger.warn(f"LoRA {lora_filename} not found or invalid, using standard workflow")
-                lora_name = None
+        # Validate every LoRA against the cache and manifest in parallel before queueing;
+        # held LoRAs are not evicted by other jobs' installs until this job ends
+        held_loras = [spec["name"] for spec in loras]
+        lora_cache.hold(held_loras)
+        resolved_loras = resolve_loras(loras)
+        for resolved in resolved_loras:
+            if resolved["status"] == "rejected":
+                return resolved["rejection"]
+        active_loras = [r for r in resolved_loras if r["status"] == "ready"]
+        for resolved in active_loras:
+            emit({"event": "lora_ready", "lora": resolved["name"], "source": resolved["source"]})
+        lora_download = {r["name"]: r["download"] for r in resolved_loras if r.get("download")} or None
         
         # Load appropriate workflow
-        workflow = handler.load_workflow(is_img2img=is_img2img, lora_name=workflow_lora_name if use_lora else None)
-        workflow = handler.update_prompt(workflow, prompt, width, height, image_data, workflow_lora_name if use_lora else None, lora_strength)
+        with span("workflow_build"):
+            workflow = handler.load_workflow(is_img2img=is_img2img, loras=active_loras)
+            workflow = handler.update_prompt(workflow, prompt, width, height, image_name, batch_size, seed)
+            if resolution["tiled_decode"]:
+                use_tiled_decode(workflow, resolution["tile_size"])
+        
+        # Don't queue work nobody is waiting for
+        cancel.check()
+        
+        # Per-job filename so a cached SaveImage never hands back another job's (discarded) file
+        job_id = job.get('id', 'test')
+        workflow.set_inputs("save_image", filename_prefix=f"flux_{job_id}")
         
         # Queue generation
-        prompt_id = handler.queue_prompt(workflow)
+        with span("queue_submit"):
+            prompt_id = handler.queue_prompt(workflow)
         logger.info(f"Queued with ID: {prompt_id}")
+        emit({"event": "queued", "prompt_id": prompt_id})
         
         # Wait for result
-        image_data = handler.wait_for_image(prompt_id)
+        on_event = job_event_listener(emit, float(job_input.get('preview_interval', 0))) if streaming else None
+        images = handler.wait_for_images(prompt_id, workflow, timeout=cancel.remaining(600), on_event=on_event, cancel=cancel)
+        
+        # Stream every image of the batch from /view into R2 or base64 concurrently
+        batched = len(images) > 1
+        with ThreadPoolExecutor(max_workers=min(len(images), OUTPUT_WORKERS)) as pool:
+            outputs = list(pool.map(
+                lambda item: handler.stream_output(item[1], job_id, output_format, output_quality, item[0] if batched else None),
+                enumerate(images)
+            ))
+        for output in outputs:
+            spans.add_max("image_fetch", output["timings"]["fetch_ms"] / 1000)
+            spans.add_max("encode", output["encode_ms"] / 1000)
+            if "upload_ms" in output["timings"]:
+                spans.add_max("r2_upload", output["timings"]["upload_ms"] / 1000)
         
-        # Upload or return
+        result = {
+            "status": "success",
+            "model": "flux-dev",
+            "comfyui_latency": comfy_client.stats(),
+            "lora_cache": lora_cache.stats(),
+            "lora_manifest": lora_manifest.stats(),
+            "s3_credentials": credential_bootstrap.stats(),
+            "loras": [{k: r[k] for k in ("name", "strength", "status", "source")} for r in resolved_loras],
+            "resolution": resolution,
+            "lora_download": lora_download,
+            "disk_gc": disk_gc.stats(),
+            "cancellation": cancel_watcher.stats()
+        }
         if s3_client:
-            url = handler.upload_to_r2(image_data, job.get('id', 'test'))
-            return {
-                "status": "success",
-                "image_url": url,
-                "model": "flux-dev"
-            }
+            urls = [output.pop("url") for output in outputs]
+            result["image_url"] = urls[0]
+            if batched:
+                result["image_urls"] = urls
         else:
             # Return base64 (watch size!)
-            return {
-                "status": "success",
-                "image": base64.b64encode(image_data).decode('utf-8'),
-                "model": "flux-dev"
-            }
-            
+            encoded = [output.pop("base64") for output in outputs]
+            result["image"] = encoded[0]
+            if batched:
+                result["images"] = encoded
+        result["output"] = outputs[0]
+        if batched:
+            result["outputs"] = outputs
+        if cache_key and len(active_loras) == len(loras):
+            # Jobs that ran without a requested LoRA are not cached under its key
+            result["seed"] = seed
+            result_cache.put(cache_key, {k: result[k] for k in CACHED_RESULT_FIELDS if k in result})
+        result["timings"] = record_job_timings(job, spans, "success", num_images=len(images), loras=len(active_loras), img2img=is_img2img)
+        return result
+    
+    except JobCancelled as e:
+        # The prompt was already withdrawn from ComfyUI by wait_for_images
+        logger.warn(f"Job {job.get('id')} cancelled ({e.reason})")
+        return dict(
+            e.details,
+            status="cancelled",
+            error=str(e),
+            reason=e.reason,
+            timings=record_job_timings(job, spans, "cancelled", reason=e.reason)
+        )
     except Exception as e:
         logger.error(f"Handler error: {str(e)}")
         logger.error(f"Error type: {type(e).__name__}")
         logger.error(f"Traceback: {traceback.format_exc()}")
         return {
             "status": "error",
-            "error": str(e)
+            "error": str(e),
+            "timings": record_job_timings(job, spans, "error", error=type(e).__name__)
         }
+    finally:
+        cancel_watcher.unwatch(job.get('id'))
+        input_images.release(input_digest)
+        lora_cache.release(held_loras)
+
+# Streaming mode: progress/preview events go out on /stream only (see streaming_handler)
+STREAM_EVENTS = os.environ.get('FLUX_STREAM_EVENTS', '').lower() in ('1', 'true', 'yes')
+
+async def async_handler(job):
+    """Run the blocking pipeline off the event loop and return its result dict
+    
+    Pre-processing (LoRA fetch, input upload) and post-processing (/view,
+    encode, R2) of one job overlap with another job sampling in ComfyUI's
+    queue. /run, /runsync and /status get the same result dict (including
+    {"status": "error", ...} results) as a plain handler.
+    """
+    cancel = CancelToken()
+    try:
+        return await asyncio.to_thread(runpod_handler, job, None, cancel)
+    except asyncio.CancelledError:
+        # RunPod dropped the job: the pipeline thread withdraws its prompt from ComfyUI
+        cancel.cancel("runpod_cancel")
+        raise
+
+async def streaming_handler(job):
+    """Yield job events while the pipeline runs, then {"event": "result", "result": result}
+    
+    Used when FLUX_STREAM_EVENTS is set. Items are only delivered on
+    /stream (the worker runs without return_aggregate_stream), so clients
+    submit with /run and read /stream until the "result" event; /runsync and
+    /status carry no output. Error results are wrapped like any other result
+    and never end the stream early.
+    """
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    
+    def emit(event):
+        loop.call_soon_threadsafe(events.put_nowait, event)
+    
+    cancel = CancelToken()
+    task = asyncio.ensure_future(asyncio.to_thread(runpod_handler, job, emit, cancel))
+    try:
+        while not task.done():
+            next_event = asyncio.ensure_future(events.get())
+            await asyncio.wait({next_event, task}, return_when=asyncio.FIRST_COMPLETED)
+            if next_event.done():
+                yield next_event.result()
+            else:
+                next_event.cancel()
+    except (asyncio.CancelledError, GeneratorExit):
+        cancel.cancel("runpod_cancel")
+        raise
+    while not events.empty():
+        yield events.get_nowait()
+    yield {"event": "result", "result": task.result()}
+
+# Each extra in-flight job is budgeted this much free VRAM (batched latents, VAE decode)
+VRAM_PER_EXTRA_JOB_GB = float(os.environ.get('FLUX_VRAM_PER_JOB_GB', 10))
+MAX_CONCURRENCY = 4
+
+def free_vram_gb() -> Optional[float]:
+    """Free VRAM of the roomiest device from /system_stats, None if unavailable"""
+    try:
+        devices = comfy_client.system_stats().get('devices', [])
+        return max(device.get('vram_free', 0) for device in devices) / (1024 ** 3)
+    except Exception as e:
+        logger.warn(f"Could not read free VRAM: {e}")
+        return None
+
+def default_concurrency() -> int:
+    """FLUX_CONCURRENCY if set, otherwise derived from free VRAM in /system_stats"""
+    configured = os.environ.get('FLUX_CONCURRENCY')
+    if configured:
+        return max(1, int(configured))
+    free_gb = free_vram_gb()
+    if free_gb is None:
+        logger.warn("Running one job at a time")
+        return 1
+    concurrency = max(1, min(MAX_CONCURRENCY, 1 + int(free_gb // VRAM_PER_EXTRA_JOB_GB)))
+    logger.info(f"Free VRAM {free_gb:.1f} GB -> {concurrency} concurrent job(s)")
+    return concurrency
+
+def concurrency_modifier(current_concurrency: int) -> int:
+    return job_concurrency
+
+WARMUP_SIZE = 64
+WARMUP_TIMEOUT = 600
+
+def warm_up() -> Dict[str, float]:
+    """Run tiny 1-step generations so UNET, CLIP and VAE are loaded before the first job
+    
+    Uses the flux_actual graph and, when a pinned LoRA is available locally,
+    the same graph with that LoRA chained in, so its loader is cached too.
+    Returns seconds per graph.
+    """
+    graphs = [("flux_actual", None)]
+    for name in sorted(lora_cache.pinned):
+        if any(os.path.exists(path) for path in [lora_cache.path(name), *handler.volume_lora_paths(name)]):
+            graphs.append(("dynamic_lora", name))
+            break
+    
+    timings = {}
+    for label, lora_name in graphs:
+        start = time.time()
+        try:
+            workflow = handler.load_workflow(loras=[{"name": lora_name, "strength": 1.0}] if lora_name else None)
+            workflow = handler.update_prompt(workflow, "warm-up", WARMUP_SIZE, WARMUP_SIZE, seed=1)
+            workflow.set_inputs("sampler", steps=1)
+            workflow.set_inputs("save_image", filename_prefix="warmup")
+            prompt_id = handler.queue_prompt(workflow)
+            for image in handler.wait_for_images(prompt_id, workflow, timeout=WARMUP_TIMEOUT):
+                disk_gc.discard(os.path.join(COMFYUI_OUTPUT_DIR, image.get('subfolder', ''), image['filename']))
+        except Exception as e:
+            logger.warn(f"Warm-up with {label} failed: {e}")
+            continue
+        timings[label] = round(time.time() - start, 3)
+        logger.info(f"Warm-up with {label} took {timings[label]}s")
+    return timings
 
-# Start RunPod handler
-runpod.serverless.start({"handler": runpod_handler})
\ No newline at end of file
+# Start RunPod handler once ComfyUI is actually up
+supervisor.wait_ready()
+# Optional warm-up; the worker only takes jobs once it is done
+warmup_timings = {}
+if os.environ.get('FLUX_WARMUP', '1') != '0':
+    with startup_spans.span("warmup"):
+        warmup_timings = warm_up()
+cold_start_timings = [dict(startup_spans.to_dict(), comfyui_boot=supervisor.timings, warmup_graphs=warmup_timings)]
+job_concurrency = default_concurrency()
+runpod.serverless.start({
+    "handler": streaming_handler if STREAM_EVENTS else async_handler,
+    "concurrency_modifier": concurrency_modifier
+})
\ No newline at end of file
@@ -2,9 +2,9 @@ import runpod
 import torch
 from diffusers import StableDiffusionPipeline, DPMSolverMultistepScheduler
 import base64
-from io import BytesIO
 import os
 import time
+from output_encoding import output_options, encode_async
 
 device = "cuda" if torch.cuda.is_available() else "cpu"
 pipe = None
@@ -42,7 +42,8 @@ def handler(job):
             "height": 512,
             "num_inference_steps": 20,
             "guidance_scale": 7.5,
-            "seed": -1
+            "seed": -1,
+            "output_format": "png"  # png, webp, avif or jpeg (optional output_quality, or png_compress_level)
         }
     }
     """
@@ -61,6 +62,7 @@ def handler(job):
         num_inference_steps = job_input.get('num_inference_steps', 20)
         guidance_scale = job_input.get('guidance_scale', 7.5)
         seed = job_input.get('seed', -1)
+        output_format, output_quality = output_options(job_input)
         
         if seed == -1:
             seed = int(time.time())
@@ -77,12 +79,13 @@ def handler(job):
             generator=generator
         ).images[0]
         
-        buffered = BytesIO()
-        image.save(buffered, format="PNG")
-        image_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
+        # Encode off the handler thread (PIL image in, no intermediate PNG)
+        image_data, encoding = encode_async(image, output_format, output_quality).result()
+        image_base64 = base64.b64encode(image_data).decode('utf-8')
         
         return {
             "image_base64": image_base64,
+            "output": encoding,
             "seed": seed,
             "prompt": prompt,
             "width": width,
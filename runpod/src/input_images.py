@@ -0,0 +1,133 @@
+"""
+Zero-disk img2img input pipeline
+Decodes the base64 payload in chunks, fits the image to the target latent
+size in memory and uploads it to ComfyUI's /upload/image under a
+content-addressed name, so repeated inputs are uploaded once. Inputs no
+longer referenced by a running job are deleted from ComfyUI's input
+directory, keeping only a few recent ones for reuse.
+"""
+
+import base64
+import binascii
+import hashlib
+import io
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+from PIL import Image
+
+from runpod.serverless.modules.rp_logger import RunPodLogger
+
+logger = RunPodLogger()
+
+# Multiple of 4 so every chunk decodes independently
+DECODE_CHUNK_CHARS = 4 * 1024 * 1024
+SUBFOLDER = "runpod_inputs"
+WHITESPACE = re.compile(r"\s")
+
+
+def decode_base64_image(payload: str) -> bytes:
+    """Decode a (possibly data-URL) base64 image without an intermediate joined copy"""
+    if payload.startswith("data:") and "," in payload:
+        payload = payload.split(",", 1)[1]
+    if WHITESPACE.search(payload):
+        # Wrapped base64 (anywhere in the payload): chunk boundaries would not line up with quanta
+        payload = "".join(payload.split())
+    payload += "=" * (-len(payload) % 4)
+
+    out = io.BytesIO()
+    try:
+        for start in range(0, len(payload), DECODE_CHUNK_CHARS):
+            out.write(base64.b64decode(payload[start:start + DECODE_CHUNK_CHARS], validate=True))
+    except binascii.Error as e:
+        raise ValueError(f"Invalid base64 image: {e}")
+    return out.getvalue()
+
+
+def fit_image(data: bytes, width: int = None, height: int = None) -> bytes:
+    """Convert to RGB and downscale to cover width x height; small inputs pass through untouched"""
+    with Image.open(io.BytesIO(data)) as image:
+        needs_convert = image.mode not in ("RGB", "RGBA")
+        scale = 1.0
+        if width and height:
+            scale = max(width / image.width, height / image.height)
+        if not needs_convert and scale >= 1.0:
+            return data
+
+        if needs_convert:
+            image = image.convert("RGB")
+        if scale < 1.0:
+            size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            image = image.resize(size, Image.LANCZOS)
+        out = io.BytesIO()
+        image.save(out, format="PNG", compress_level=1)
+        return out.getvalue()
+
+
+class InputImageStore:
+    """Content-addressed, ref-counted inputs in ComfyUI's input directory"""
+
+    def __init__(self, client, input_dir: str = "/ComfyUI/input", keep: int = 8):
+        self.client = client
+        self.input_dir = input_dir
+        self.keep = keep
+        self._lock = threading.Lock()
+        # digest -> {"name": LoadImage value, "refs": active jobs}, oldest first
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.counters = {"uploads": 0, "reused": 0, "deleted": 0, "uploaded_bytes": 0}
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.input_dir, name)
+
+    def acquire(self, data: bytes, width: int = None, height: int = None) -> Tuple[str, str]:
+        """Return (LoadImage value, digest) for the image; release(digest) when the job ends"""
+        data = fit_image(data, width, height)
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry and os.path.exists(self._path(entry["name"])):
+                # Keep the age-based disk GC off inputs that are still in use
+                try:
+                    os.utime(self._path(entry["name"]))
+                except OSError:
+                    pass
+                entry["refs"] += 1
+                self._entries.move_to_end(digest)
+                self.counters["reused"] += 1
+                return entry["name"], digest
+
+        uploaded = self.client.upload_image(data, f"{digest[:32]}.png", subfolder=SUBFOLDER)
+        name = f"{uploaded['subfolder']}/{uploaded['name']}" if uploaded.get("subfolder") else uploaded["name"]
+        with self._lock:
+            entry = self._entries.setdefault(digest, {"name": name, "refs": 0})
+            entry["refs"] += 1
+            self._entries.move_to_end(digest)
+            self.counters["uploads"] += 1
+            self.counters["uploaded_bytes"] += len(data)
+        return name, digest
+
+    def release(self, digest: Optional[str]):
+        """Drop a job's reference and delete unreferenced inputs beyond the keep limit"""
+        if not digest:
+            return
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry:
+                entry["refs"] = max(0, entry["refs"] - 1)
+            idle = [d for d, e in self._entries.items() if e["refs"] == 0]
+            for d in idle[:max(0, len(idle) - self.keep)]:
+                name = self._entries.pop(d)["name"]
+                try:
+                    os.remove(self._path(name))
+                    self.counters["deleted"] += 1
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warn(f"Could not delete input image {name}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.counters, cached=len(self._entries))
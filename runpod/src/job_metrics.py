@@ -0,0 +1,162 @@
+"""
+Per-stage job latency instrumentation
+A lightweight span recorder attached to each job (via a context variable, so
+helpers deep in the pipeline can record without extra parameters), a
+rotating JSON-lines log on the volume and p50/p95 aggregation over it.
+"""
+
+import contextlib
+import contextvars
+import glob
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict, deque
+from logging.handlers import RotatingFileHandler
+from typing import Dict, Any, Iterable, List, Optional
+
+_current: "contextvars.ContextVar[Optional[SpanRecorder]]" = contextvars.ContextVar("job_spans", default=None)
+
+
+class SpanRecorder:
+    """Named stage durations for one job (or worker startup), in milliseconds"""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._spans: "OrderedDict[str, float]" = OrderedDict()
+        self._notes: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name: str):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - start)
+
+    def add(self, name: str, seconds: float):
+        """Accumulate seconds into a stage (repeated stages add up)"""
+        with self._lock:
+            self._spans[name] = self._spans.get(name, 0.0) + seconds * 1000
+
+    def add_max(self, name: str, seconds: float):
+        """Record the longest of several concurrent runs of a stage"""
+        with self._lock:
+            self._spans[name] = max(self._spans.get(name, 0.0), seconds * 1000)
+
+    def note(self, name: str, value: Any):
+        """Attach a non-duration value (e.g. a cache report) to the timings"""
+        with self._lock:
+            self._notes[name] = value
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            result = {name: round(ms, 1) for name, ms in self._spans.items()}
+            result.update(self._notes)
+        result["total"] = round((time.time() - self.started_at) * 1000, 1)
+        return result
+
+
+def begin_job() -> SpanRecorder:
+    """Start a recorder for the job running in the current context"""
+    recorder = SpanRecorder()
+    _current.set(recorder)
+    return recorder
+
+
+def current() -> Optional[SpanRecorder]:
+    return _current.get()
+
+
+@contextlib.contextmanager
+def span(name: str):
+    """Time a stage of the current job; a no-op outside a job"""
+    recorder = _current.get()
+    if recorder is None:
+        yield
+    else:
+        with recorder.span(name):
+            yield
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def aggregate(records: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    """stage -> {count, p50, p95, max} over the timings of the given records"""
+    by_stage: Dict[str, List[float]] = {}
+    for record in records:
+        for stage, ms in (record.get("timings") or {}).items():
+            if isinstance(ms, (int, float)):
+                by_stage.setdefault(stage, []).append(ms)
+    return {
+        stage: {
+            "count": len(values),
+            "p50": _percentile(values, 50),
+            "p95": _percentile(values, 95),
+            "max": max(values)
+        }
+        for stage, values in sorted(by_stage.items())
+    }
+
+
+class MetricsLog:
+    """Rotating per-worker JSONL file of job records plus an in-memory window"""
+
+    def __init__(self, directory: str, max_bytes: int = 10 * 1024 * 1024, backups: int = 3, window: int = 500):
+        self.directory = directory
+        self.worker_id = os.environ.get('RUNPOD_POD_ID') or socket.gethostname()
+        self.path = os.path.join(directory, f"jobs-{self.worker_id}.jsonl")
+        self.recent = deque(maxlen=window)
+        self._logger = logging.getLogger(f"job_metrics.{self.worker_id}")
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            handler = RotatingFileHandler(self.path, maxBytes=max_bytes, backupCount=backups)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._logger.addHandler(handler)
+        except OSError:
+            # No volume mounted: keep the in-memory window only
+            self.path = None
+
+    def append(self, record: Dict[str, Any]):
+        record = dict(record, ts=round(time.time(), 3), worker=self.worker_id)
+        self.recent.append(record)
+        if self.path:
+            self._logger.info(json.dumps(record, default=str))
+
+    def records(self, scope: str = "worker", since: float = 0) -> List[Dict[str, Any]]:
+        """Records from this worker's window, or from every worker's files on the volume"""
+        if scope != "volume" or not self.path:
+            return [r for r in self.recent if r.get("ts", 0) >= since]
+        records = []
+        for path in glob.glob(os.path.join(self.directory, "jobs-*.jsonl*")):
+            try:
+                with open(path, "r") as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            continue
+                        if record.get("ts", 0) >= since:
+                            records.append(record)
+            except OSError:
+                continue
+        return records
+
+    def summary(self, scope: str = "worker", since: float = 0) -> Dict[str, Any]:
+        records = self.records(scope, since)
+        return {
+            "scope": scope,
+            "jobs": len(records),
+            "errors": sum(1 for r in records if r.get("status") != "success"),
+            "stages": aggregate(records)
+        }
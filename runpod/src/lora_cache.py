@@ -0,0 +1,198 @@
+"""
+Size-bounded local LoRA cache
+Tracks LoRAs installed on the worker's local disk, evicts least recently
+used entries to stay within a byte budget, never evicts pinned house LoRAs
+or LoRAs held by running jobs, and installs files atomically (temp file +
+rename)
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Dict, Any, Callable, Iterable, Optional
+
+from runpod.serverless.modules.rp_logger import RunPodLogger
+from singleflight import SingleFlight
+
+logger = RunPodLogger()
+
+INDEX_FILENAME = ".lora_cache.json"
+PARTIAL_SUFFIX = ".part"
+
+
+class LoraCache:
+    """LRU cache of LoRA files in a single directory"""
+
+    def __init__(self, cache_dir: str, budget_bytes: int, pinned: Iterable[str] = ()):
+        self.cache_dir = cache_dir
+        self.budget_bytes = budget_bytes
+        self.pinned = set(pinned)
+        self.index_path = os.path.join(cache_dir, INDEX_FILENAME)
+        self._lock = threading.Lock()
+        # Only files installed through the cache are eligible for eviction, so
+        # LoRAs that live on a mounted network volume are never deleted
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        # name -> number of in-flight jobs using the LoRA
+        self._holds: Dict[str, int] = {}
+        self.counters = {"hits": 0, "misses": 0, "installs": 0, "evictions": 0, "evicted_bytes": 0}
+        # One fetch per LoRA; lock files in the cache dir extend this to other processes
+        self.flights = SingleFlight(lock_dir=cache_dir)
+        self._load_index()
+
+    @classmethod
+    def from_env(cls, default_dir: str = "/ComfyUI/models/loras") -> "LoraCache":
+        budget_gb = float(os.environ.get('LORA_CACHE_GB', 20))
+        pinned = os.environ.get('LORA_CACHE_PINNED', 'mix4.safetensors')
+        return cls(
+            os.environ.get('LORA_CACHE_DIR', default_dir),
+            int(budget_gb * 1024 ** 3),
+            [p.strip() for p in pinned.split(',') if p.strip()]
+        )
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return
+        for name, entry in entries.items():
+            if os.path.exists(self.path(name)):
+                self._entries[name] = entry
+
+    def _save_index(self):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{self.index_path}.{uuid.uuid4().hex}{PARTIAL_SUFFIX}"
+            with open(tmp_path, 'w') as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            logger.warn(f"Could not persist LoRA cache index: {e}")
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.cache_dir, name)
+
+    def bytes_used(self) -> int:
+        return sum(entry["size"] for entry in self._entries.values())
+
+    def lookup(self, name: str, extra_paths: Iterable[str] = ()) -> Optional[str]:
+        """Return a local path for the LoRA and record a hit, or None on a miss"""
+        for path in [self.path(name), *extra_paths]:
+            if os.path.exists(path) and os.path.getsize(path) > 0:
+                with self._lock:
+                    self.counters["hits"] += 1
+                    if name in self._entries and path == self.path(name):
+                        # Persisted with the next install or eviction, not on every hit
+                        self._entries[name]["last_used"] = time.time()
+                return path
+        with self._lock:
+            self.counters["misses"] += 1
+        return None
+
+    def hold(self, names: Iterable[str]):
+        """Protect LoRAs from eviction until release(names); call before resolving them"""
+        with self._lock:
+            for name in names:
+                self._holds[name] = self._holds.get(name, 0) + 1
+
+    def release(self, names: Iterable[str]):
+        """Drop a job's hold on LoRAs taken with hold(names)"""
+        with self._lock:
+            for name in names:
+                count = self._holds.get(name, 0) - 1
+                if count > 0:
+                    self._holds[name] = count
+                else:
+                    self._holds.pop(name, None)
+
+    def install(self, name: str, fetch: Callable[[str], Any], expected_size: int = None) -> Optional[str]:
+        """Fetch into a temp file via fetch(tmp_path) and atomically move it into place
+
+        Concurrent installs of the same LoRA share a single fetch.
+        """
+        return self.flights.do(
+            name,
+            lambda: self._install(name, fetch, expected_size),
+            check=lambda: self._adopt(name)
+        )
+
+    def _adopt(self, name: str) -> Optional[str]:
+        """Pick up a file another caller installed while we waited for the lock"""
+        path = self.path(name)
+        if not os.path.exists(path):
+            return None
+        with self._lock:
+            if name not in self._entries:
+                self._entries[name] = {"size": os.path.getsize(path), "installed": time.time(), "last_used": time.time()}
+                self._save_index()
+        return path
+
+    def _install(self, name: str, fetch: Callable[[str], Any], expected_size: int = None) -> Optional[str]:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        if expected_size:
+            self.evict(incoming=expected_size)
+
+        final_path = self.path(name)
+        tmp_path = os.path.join(self.cache_dir, f".{name}.{uuid.uuid4().hex}{PARTIAL_SUFFIX}")
+        try:
+            if fetch(tmp_path) is False or not os.path.exists(tmp_path):
+                raise IOError(f"Fetch for {name} produced no file")
+            size = os.path.getsize(tmp_path)
+            if expected_size and size != expected_size:
+                raise IOError(f"Size mismatch for {name}: {size} != {expected_size}")
+            os.replace(tmp_path, final_path)
+        except Exception as e:
+            logger.error(f"Failed to install LoRA {name}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return None
+
+        with self._lock:
+            self._entries[name] = {"size": size, "installed": time.time(), "last_used": time.time()}
+            self.counters["installs"] += 1
+            self._save_index()
+        self.evict()
+        logger.info(f"Installed LoRA {name} in cache ({size / (1024 * 1024):.1f} MB)")
+        return final_path
+
+    def evict(self, incoming: int = 0) -> int:
+        """Evict least recently used entries that are neither pinned nor held until the budget fits"""
+        freed = 0
+        with self._lock:
+            used = self.bytes_used()
+            candidates = sorted(
+                (n for n in self._entries if n not in self.pinned and n not in self._holds),
+                key=lambda n: self._entries[n]["last_used"]
+            )
+            for name in candidates:
+                if used + incoming <= self.budget_bytes:
+                    break
+                size = self._entries.pop(name)["size"]
+                try:
+                    os.remove(self.path(name))
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warn(f"Could not evict LoRA {name}: {e}")
+                    continue
+                used -= size
+                freed += size
+                self.counters["evictions"] += 1
+                self.counters["evicted_bytes"] += size
+                logger.info(f"Evicted LoRA {name} from cache ({size / (1024 * 1024):.1f} MB)")
+            if freed:
+                self._save_index()
+        return freed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(
+                self.counters,
+                deduplicated=self.flights.counters["shared"],
+                entries=len(self._entries),
+                held=len(self._holds),
+                bytes_used=self.bytes_used(),
+                budget_bytes=self.budget_bytes
+            )
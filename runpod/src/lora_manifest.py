@@ -0,0 +1,191 @@
+"""
+Cached manifest of LoRAs in the S3 volume bucket
+Loaded once at worker start and refreshed incrementally with list_objects_v2
+on a TTL, so per-job LoRA resolution is answered from memory instead of a
+cross-region HEAD. Misses are negative-cached and re-checked with a single
+HEAD once they expire, so LoRAs uploaded by other workers still show up.
+The bucket is reached through a lazily configured volume, and nothing is
+loaded until the first LoRA lookup. Writes back to the bucket are debounced
+onto a background thread so jobs never wait on the PUT.
+"""
+
+import json
+import threading
+import time
+from typing import Dict, Any, Optional
+
+from runpod.serverless.modules.rp_logger import RunPodLogger
+
+logger = RunPodLogger()
+
+LORA_PREFIX = "ComfyUI/models/loras/"
+MANIFEST_KEY = LORA_PREFIX + ".manifest.json"
+
+
+class LoraManifest:
+    """name -> {size, etag, last_modified, sha256, header} for the LoRA prefix"""
+
+    def __init__(self, volume, ttl: float = 300, negative_ttl: float = 60, save_delay: float = 5):
+        self.volume = volume
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.save_delay = save_delay
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._negative: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()
+        self._started = False
+        self._save_pending = False
+        self.refreshed_at = 0.0
+        self.attempted_at = 0.0
+        self.counters = {"memory_hits": 0, "negative_hits": 0, "heads": 0, "refreshes": 0, "saves": 0}
+
+    def start(self):
+        """Load the persisted manifest and list the bucket in the background"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._initial_load, daemon=True).start()
+
+    def _initial_load(self):
+        try:
+            body = self.volume.client.get_object(Bucket=self.volume.bucket, Key=MANIFEST_KEY)["Body"].read()
+            with self._lock:
+                self._entries.update(json.loads(body))
+            logger.info(f"Loaded LoRA manifest with {len(self._entries)} entries")
+        except Exception as e:
+            logger.debug(f"No persisted LoRA manifest: {e}")
+        self.refresh()
+
+    def refresh(self):
+        """Reconcile with list_objects_v2, keeping derived fields for unchanged objects"""
+        if not self._refreshing.acquire(blocking=False):
+            return
+        try:
+            listed = {}
+            paginator = self.volume.client.get_paginator('list_objects_v2')
+            for page in paginator.paginate(Bucket=self.volume.bucket, Prefix=LORA_PREFIX):
+                for obj in page.get('Contents', []):
+                    name = obj['Key'][len(LORA_PREFIX):]
+                    if not name or name.startswith('.') or '/' in name:
+                        continue
+                    listed[name] = {
+                        "size": obj['Size'],
+                        "etag": obj.get('ETag', '').strip('"'),
+                        "last_modified": obj['LastModified'].timestamp() if obj.get('LastModified') else None
+                    }
+            with self._lock:
+                for name, entry in listed.items():
+                    current = self._entries.get(name)
+                    if current and current.get("etag") == entry["etag"]:
+                        current.update(entry)
+                    else:
+                        self._entries[name] = entry
+                for name in set(self._entries) - set(listed):
+                    del self._entries[name]
+                self._negative = {n: t for n, t in self._negative.items() if n not in listed}
+                self.refreshed_at = time.time()
+                self.counters["refreshes"] += 1
+            logger.info(f"LoRA manifest refreshed: {len(listed)} LoRAs in bucket")
+        except Exception as e:
+            logger.warn(f"LoRA manifest refresh failed: {e}")
+        finally:
+            self._refreshing.release()
+
+    def _maybe_refresh(self):
+        # Attempts count, not successes, so a failing bucket is retried once per TTL
+        with self._lock:
+            now = time.time()
+            if now - max(self.refreshed_at, self.attempted_at) <= self.ttl:
+                return
+            self.attempted_at = now
+        threading.Thread(target=self.refresh, daemon=True).start()
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        """Manifest entry for a LoRA, or None if it is not in the bucket"""
+        if not self.volume.available():
+            return None
+        if not self._started:
+            self.start()
+        else:
+            self._maybe_refresh()
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None:
+                self.counters["memory_hits"] += 1
+                return dict(entry)
+            checked = self._negative.get(name)
+            if checked and time.time() - checked < self.negative_ttl:
+                self.counters["negative_hits"] += 1
+                return None
+
+        # Unknown or expired miss: one HEAD to pick up uploads from other workers
+        with self._lock:
+            self.counters["heads"] += 1
+        try:
+            head = self.volume.client.head_object(Bucket=self.volume.bucket, Key=LORA_PREFIX + name)
+        except Exception:
+            with self._lock:
+                self._negative[name] = time.time()
+            return None
+        return self.record(name, head['ContentLength'], head.get('ETag', ''))
+
+    def contains(self, name: str) -> bool:
+        return self.get(name) is not None
+
+    def record(self, name: str, size: int, etag: str = '', **fields) -> Dict[str, Any]:
+        """Add or update an entry (after an upload or a HEAD)"""
+        etag = etag.strip('"')
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None or entry.get("etag") != etag:
+                # New object contents: derived fields no longer apply
+                entry = self._entries[name] = {}
+            entry.update({"size": size, "etag": etag}, **fields)
+            self._negative.pop(name, None)
+            return dict(entry)
+
+    def update(self, name: str, persist: bool = True, **fields):
+        """Attach derived fields (sha256, header summary) to an existing entry"""
+        with self._lock:
+            if name not in self._entries:
+                return
+            self._entries[name].update(fields)
+        if persist:
+            self.schedule_save()
+
+    def schedule_save(self):
+        """Persist in the background after save_delay, coalescing updates made meanwhile"""
+        with self._lock:
+            if self._save_pending:
+                return
+            self._save_pending = True
+        timer = threading.Timer(self.save_delay, self._flush)
+        timer.daemon = True
+        timer.start()
+
+    def _flush(self):
+        with self._lock:
+            self._save_pending = False
+        self.save()
+
+    def save(self):
+        """Persist the manifest to the bucket so other workers start warm"""
+        with self._lock:
+            body = json.dumps(self._entries).encode('utf-8')
+        try:
+            self.volume.client.put_object(
+                Bucket=self.volume.bucket,
+                Key=MANIFEST_KEY,
+                Body=body,
+                ContentType='application/json'
+            )
+            with self._lock:
+                self.counters["saves"] += 1
+        except Exception as e:
+            logger.warn(f"Could not persist LoRA manifest: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.counters, entries=len(self._entries))
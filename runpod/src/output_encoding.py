@@ -0,0 +1,120 @@
+"""
+Output image encoding shared by all handlers
+Re-encodes the generated PNG into the requested output_format (png, webp,
+avif, jpeg) on a small worker pool so encoding doesn't block the handler
+thread, and reports encoded size and encode time.
+"""
+
+import io
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Any, Optional, Tuple, Union
+
+from PIL import Image, features
+
+try:
+    import pillow_avif  # noqa: F401  registers AVIF on Pillow < 11
+except ImportError:
+    pass
+
+# output_format -> (Pillow format, content type, file extension, default quality)
+FORMATS = {
+    "png": ("PNG", "image/png", "png", None),
+    "webp": ("WEBP", "image/webp", "webp", 90),
+    "avif": ("AVIF", "image/avif", "avif", 75),
+    "jpeg": ("JPEG", "image/jpeg", "jpg", 92)
+}
+ALIASES = {"jpg": "jpeg"}
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="encode")
+
+
+def avif_supported() -> bool:
+    return "AVIF" in Image.registered_extensions().values() or bool(features.check("avif"))
+
+
+def _int_option(job_input: Dict[str, Any], key: str, low: int, high: int) -> Optional[int]:
+    value = job_input.get(key)
+    if value is None:
+        return None
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{key} must be an integer between {low} and {high}")
+    if not low <= value <= high:
+        raise ValueError(f"{key} must be between {low} and {high}, got {value}")
+    return value
+
+
+def output_options(job_input: Dict[str, Any]) -> Tuple[str, Optional[int]]:
+    """(format, quality) from the job input
+
+    quality is output_quality (1-100) for lossy formats and
+    png_compress_level (0-9) for PNG; None keeps the defaults, and for PNG
+    leaves ComfyUI's file untouched.
+    """
+    fmt = str(job_input.get("output_format", "png")).lower()
+    fmt = ALIASES.get(fmt, fmt)
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported output_format '{fmt}', expected one of {sorted(FORMATS)}")
+    if fmt == "png":
+        return fmt, _int_option(job_input, "png_compress_level", 0, 9)
+    return fmt, _int_option(job_input, "output_quality", 1, 100)
+
+
+def content_type(fmt: str) -> str:
+    return FORMATS[fmt][1]
+
+
+def extension(fmt: str) -> str:
+    return FORMATS[fmt][2]
+
+
+def encode_image(image: Union[bytes, Image.Image], fmt: str = "png", quality: int = None) -> Tuple[bytes, Dict[str, Any]]:
+    """Encode image (PNG bytes or a PIL image) as fmt, returns (data, stats)"""
+    start = time.time()
+    requested = fmt
+    if fmt == "avif" and not avif_supported():
+        fmt = "webp"
+
+    # PNG in, PNG out at the default level: nothing to do
+    if fmt == "png" and quality is None and isinstance(image, (bytes, bytearray)):
+        data = bytes(image)
+        return data, {"format": fmt, "bytes": len(data), "source_bytes": len(data), "encode_ms": 0.0}
+
+    source_bytes = len(image) if isinstance(image, (bytes, bytearray)) else None
+    pil_format, _, _, default_quality = FORMATS[fmt]
+    if isinstance(image, (bytes, bytearray)):
+        image = Image.open(io.BytesIO(image))
+        image.load()
+    if fmt == "jpeg" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    options = {}
+    if fmt == "png":
+        # quality is the zlib compression level for PNG
+        options["compress_level"] = quality if quality is not None else 6
+    else:
+        options["quality"] = quality if quality is not None else default_quality
+    if fmt == "webp":
+        options["method"] = 4
+    if fmt == "jpeg":
+        options["optimize"] = True
+
+    out = io.BytesIO()
+    image.save(out, format=pil_format, **options)
+    data = out.getvalue()
+    stats = {
+        "format": fmt,
+        "bytes": len(data),
+        "source_bytes": source_bytes,
+        "encode_ms": round((time.time() - start) * 1000, 1)
+    }
+    if fmt != requested:
+        stats["requested_format"] = requested
+    return data, stats
+
+
+def encode_async(image: Union[bytes, Image.Image], fmt: str = "png", quality: int = None) -> Future:
+    """encode_image on the shared encoder pool"""
+    return _executor.submit(encode_image, image, fmt, quality)
@@ -0,0 +1,124 @@
+"""
+Streaming output delivery
+Pipes an image from ComfyUI's /view straight into R2 (single PUT for small
+images, multipart with concurrent part uploads for large ones) or into an
+incremental base64 encoder, hashing and timing the bytes as they pass so the
+full image is never buffered more than once.
+"""
+
+import base64
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Iterable
+
+# S3 requires parts of at least 5 MB (except the last)
+PART_SIZE = 8 * 1024 * 1024
+PART_WORKERS = 4
+CHUNK_SIZE = 256 * 1024
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 1)
+
+
+def stream_to_r2(client, bucket: str, key: str, chunks: Iterable[bytes],
+                 content_type: str = "image/png", part_size: int = PART_SIZE) -> Dict[str, Any]:
+    """Upload an iterable of chunks to R2, returns {key, bytes, sha256, parts, timings}
+
+    Objects smaller than part_size go up as one PUT; larger ones are sent as
+    multipart uploads whose parts upload while later chunks are still read.
+    """
+    start = time.time()
+    sha256 = hashlib.sha256()
+    buffer = bytearray()
+    total = 0
+    first_byte = None
+    upload_id = None
+    futures = []
+    pool = None
+
+    def upload_part(number: int, body: bytes) -> Dict[str, Any]:
+        response = client.upload_part(
+            Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=body
+        )
+        return {"PartNumber": number, "ETag": response["ETag"]}
+
+    try:
+        for chunk in chunks:
+            if not chunk:
+                continue
+            if first_byte is None:
+                first_byte = time.time()
+            sha256.update(chunk)
+            total += len(chunk)
+            buffer += chunk
+            if len(buffer) >= part_size:
+                if upload_id is None:
+                    upload_id = client.create_multipart_upload(
+                        Bucket=bucket, Key=key, ContentType=content_type
+                    )["UploadId"]
+                    pool = ThreadPoolExecutor(max_workers=PART_WORKERS)
+                futures.append(pool.submit(upload_part, len(futures) + 1, bytes(buffer)))
+                buffer = bytearray()
+        read_done = time.time()
+
+        if upload_id is None:
+            client.put_object(Bucket=bucket, Key=key, Body=bytes(buffer), ContentType=content_type)
+        else:
+            if buffer:
+                futures.append(pool.submit(upload_part, len(futures) + 1, bytes(buffer)))
+            parts = [future.result() for future in futures]
+            client.complete_multipart_upload(
+                Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+            )
+    except Exception:
+        if upload_id is not None:
+            try:
+                client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+            except Exception:
+                pass
+        raise
+    finally:
+        if pool:
+            pool.shutdown(wait=False)
+
+    end = time.time()
+    return {
+        "key": key,
+        "bytes": total,
+        "sha256": sha256.hexdigest(),
+        "parts": len(futures) or 1,
+        "timings": {
+            "first_byte_ms": _ms((first_byte or read_done) - start),
+            "read_ms": _ms(read_done - start),
+            "upload_tail_ms": _ms(end - read_done),
+            "total_ms": _ms(end - start)
+        }
+    }
+
+
+def stream_to_base64(chunks: Iterable[bytes]) -> Dict[str, Any]:
+    """Base64-encode chunks as they arrive, returns {base64, bytes, sha256, timings}"""
+    start = time.time()
+    sha256 = hashlib.sha256()
+    encoded = []
+    carry = b""
+    total = 0
+    for chunk in chunks:
+        if not chunk:
+            continue
+        sha256.update(chunk)
+        total += len(chunk)
+        data = carry + chunk
+        # Encode whole 3-byte groups so the pieces concatenate cleanly
+        cut = len(data) - len(data) % 3
+        encoded.append(base64.b64encode(data[:cut]).decode("ascii"))
+        carry = data[cut:]
+    encoded.append(base64.b64encode(carry).decode("ascii"))
+    return {
+        "base64": "".join(encoded),
+        "bytes": total,
+        "sha256": sha256.hexdigest(),
+        "timings": {"total_ms": _ms(time.time() - start)}
+    }
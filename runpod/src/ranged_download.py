@@ -0,0 +1,207 @@
+"""
+Parallel ranged downloader for LoRA and model files
+Splits an object into byte ranges, fetches them concurrently into a
+preallocated file with pwrite, verifies size/checksum and reports throughput.
+Shared by the worker and the LoRA CLI tools, so it only depends on requests
+(and boto3 for S3 sources).
+"""
+
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Any, Iterator, Optional, Tuple
+
+import requests
+
+DEFAULT_PART_SIZE = 16 * 1024 * 1024
+DEFAULT_WORKERS = 8
+CHUNK_SIZE = 1024 * 1024
+PART_RETRIES = 3
+
+
+class HttpSource:
+    """Plain HTTP(S) object, e.g. a Firebase Storage download URL"""
+
+    # HTTP ETags are opaque, so they are not used for verification
+    etag_is_md5 = False
+
+    def __init__(self, url: str, session: requests.Session = None, timeout=(10, 60)):
+        self.url = url
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.etag = None
+
+    def describe(self) -> Tuple[Optional[int], bool]:
+        """Return (size, supports_ranges) using a one-byte range probe"""
+        response = self.session.get(self.url, headers={"Range": "bytes=0-0"}, stream=True, timeout=self.timeout)
+        try:
+            response.raise_for_status()
+            self.etag = response.headers.get("ETag")
+            content_range = response.headers.get("Content-Range", "")
+            if response.status_code == 206 and "/" in content_range:
+                total = content_range.rsplit("/", 1)[1]
+                return (int(total) if total.isdigit() else None), True
+            length = response.headers.get("Content-Length")
+            return (int(length) if length else None), False
+        finally:
+            response.close()
+
+    def read(self, start: int = None, end: int = None) -> Iterator[bytes]:
+        headers = {"Range": f"bytes={start}-{end}"} if start is not None else {}
+        response = self.session.get(self.url, headers=headers, stream=True, timeout=self.timeout)
+        response.raise_for_status()
+        if start is not None and response.status_code != 206:
+            response.close()
+            raise IOError(f"Server ignored range request ({response.status_code})")
+        try:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                yield chunk
+        finally:
+            response.close()
+
+
+class S3Source:
+    """Object in an S3-compatible bucket (RunPod network volume, R2)"""
+
+    etag_is_md5 = True
+
+    def __init__(self, client, bucket: str, key: str):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.etag = None
+
+    def describe(self) -> Tuple[Optional[int], bool]:
+        head = self.client.head_object(Bucket=self.bucket, Key=self.key)
+        self.etag = head.get("ETag")
+        return head["ContentLength"], True
+
+    def read(self, start: int = None, end: int = None) -> Iterator[bytes]:
+        kwargs = {"Bucket": self.bucket, "Key": self.key}
+        if start is not None:
+            kwargs["Range"] = f"bytes={start}-{end}"
+        body = self.client.get_object(**kwargs)["Body"]
+        try:
+            for chunk in body.iter_chunks(chunk_size=CHUNK_SIZE):
+                yield chunk
+        finally:
+            body.close()
+
+
+def _write_at(fd: int, data: bytes, offset: int, lock: threading.Lock):
+    if hasattr(os, "pwrite"):
+        while data:
+            written = os.pwrite(fd, data, offset)
+            data = data[written:]
+            offset += written
+    else:
+        # Windows has no pwrite; serialize seek + write instead
+        with lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            os.write(fd, data)
+
+
+def _file_digest(path: str, algorithm: str) -> str:
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def download(source, dest_path: str, part_size: int = DEFAULT_PART_SIZE,
+             workers: int = DEFAULT_WORKERS, expected_sha256: str = None,
+             on_progress: Callable[[int, Optional[int]], None] = None) -> Dict[str, Any]:
+    """Download source into dest_path, returns throughput stats
+
+    Raises IOError if the size or checksum does not verify; the partially
+    written file is removed in that case.
+    """
+    start_time = time.time()
+    size, ranged = source.describe()
+    lock = threading.Lock()
+    received = [0]
+
+    def progress(n):
+        with lock:
+            received[0] += n
+            done = received[0]
+        if on_progress:
+            on_progress(done, size)
+
+    os.makedirs(os.path.dirname(os.path.abspath(dest_path)), exist_ok=True)
+    fd = os.open(dest_path, os.O_CREAT | os.O_WRONLY | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+    parts = 1
+    try:
+        if size and ranged and size > part_size:
+            # Preallocate so every part can pwrite at its own offset
+            if hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(fd, 0, size)
+            else:
+                os.ftruncate(fd, size)
+
+            ranges = [(offset, min(offset + part_size, size) - 1) for offset in range(0, size, part_size)]
+            parts = len(ranges)
+
+            def fetch_part(part):
+                first, last = part
+                for attempt in range(PART_RETRIES):
+                    offset = first
+                    try:
+                        for chunk in source.read(first, last):
+                            _write_at(fd, chunk, offset, lock)
+                            offset += len(chunk)
+                            progress(len(chunk))
+                        if offset != last + 1:
+                            raise IOError(f"Short range {first}-{last}: got {offset - first} bytes")
+                        return
+                    except Exception:
+                        progress(first - offset)
+                        if attempt == PART_RETRIES - 1:
+                            raise
+                        time.sleep(0.5 * (2 ** attempt))
+
+            with ThreadPoolExecutor(max_workers=min(workers, parts)) as pool:
+                for future in [pool.submit(fetch_part, part) for part in ranges]:
+                    future.result()
+        else:
+            offset = 0
+            for chunk in source.read():
+                _write_at(fd, chunk, offset, lock)
+                offset += len(chunk)
+                progress(len(chunk))
+        os.fsync(fd)
+    except Exception:
+        os.close(fd)
+        os.remove(dest_path)
+        raise
+    os.close(fd)
+
+    elapsed = time.time() - start_time
+    actual_size = os.path.getsize(dest_path)
+    stats = {
+        "bytes": actual_size,
+        "parts": parts,
+        "seconds": round(elapsed, 3),
+        "mb_per_s": round(actual_size / (1024 * 1024) / elapsed, 1) if elapsed > 0 else 0.0
+    }
+
+    try:
+        if size is not None and actual_size != size:
+            raise IOError(f"Size mismatch: expected {size} bytes, got {actual_size}")
+        etag = (source.etag or "").strip('"')
+        if expected_sha256:
+            stats["sha256"] = _file_digest(dest_path, "sha256")
+            if stats["sha256"] != expected_sha256.lower():
+                raise IOError(f"SHA-256 mismatch for {dest_path}")
+        elif source.etag_is_md5 and len(etag) == 32 and "-" not in etag:
+            # Single-part S3 ETags are the object's MD5
+            if _file_digest(dest_path, "md5") != etag.lower():
+                raise IOError(f"MD5/ETag mismatch for {dest_path}")
+            stats["md5_verified"] = True
+    except IOError:
+        os.remove(dest_path)
+        raise
+    return stats
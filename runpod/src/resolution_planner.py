@@ -0,0 +1,107 @@
+"""
+Resolution planning for FLUX jobs
+Requested sizes are snapped to a fixed set of aspect-ratio buckets in
+multiples of 64. Peak VRAM for sampling and VAE decode is estimated from the
+latent size, with the same per-pixel factors ComfyUI uses for its own memory
+planning. When a full decode would not fit in the free VRAM, the graph's
+VAEDecode nodes are switched to VAEDecodeTiled.
+"""
+
+import math
+from typing import Dict, Any, Optional, Tuple
+
+STEP = 64
+MIN_SIDE = 256
+MAX_SIDE = 2048
+
+# Supported aspect ratios (width, height)
+ASPECT_RATIOS = ((1, 1), (5, 4), (4, 5), (4, 3), (3, 4), (3, 2), (2, 3), (16, 9), (9, 16), (21, 9), (9, 21))
+
+GB = 1024 ** 3
+
+# Resident weights plus ComfyUI's memory factors (bf16 activations)
+MODEL_PROFILES: Dict[str, Dict[str, float]] = {
+    "flux": {
+        "weights_gb": 11.9,             # fp8 UNET; T5/CLIP are offloaded after encoding
+        "sampling_factor": 2.8,         # memory_usage_factor of the FLUX model
+        "decode_bytes_per_latent": 2178 * 64 * 2,
+        "latent_scale": 8
+    }
+}
+
+TILE_SIZE = 512
+TILE_OVERLAP = 64
+
+
+def snap_resolution(width: int, height: int) -> Tuple[int, int, str]:
+    """Nearest bucket with about the same pixel count, returns (width, height, aspect)"""
+    width, height = max(1, int(width)), max(1, int(height))
+    ratio = math.log(width / height)
+    aspect_w, aspect_h = min(ASPECT_RATIOS, key=lambda a: abs(math.log(a[0] / a[1]) - ratio))
+    aspect = aspect_w / aspect_h
+
+    area = min(max(width * height, MIN_SIDE * MIN_SIDE), MAX_SIDE * MAX_SIDE)
+    snapped_w = max(MIN_SIDE, min(MAX_SIDE, round(math.sqrt(area * aspect) / STEP) * STEP))
+    snapped_h = max(MIN_SIDE, min(MAX_SIDE, round(snapped_w / aspect / STEP) * STEP))
+    return snapped_w, snapped_h, f"{aspect_w}:{aspect_h}"
+
+
+def estimate_vram(width: int, height: int, batch_size: int = 1, model: str = "flux",
+                  tile_size: Optional[int] = None) -> Dict[str, float]:
+    """Estimated GB for weights, sampling activations, VAE decode and the peak of them"""
+    profile = MODEL_PROFILES[model]
+    scale = profile["latent_scale"]
+    latent_pixels = (width // scale) * (height // scale)
+    sampling = batch_size * latent_pixels * 2 * 0.01 * profile["sampling_factor"] * 1024 * 1024
+    # Decode memory is per image (ComfyUI splits batches to fit), per tile when tiled
+    if tile_size:
+        decode_pixels = min(latent_pixels, (tile_size // scale) ** 2)
+    else:
+        decode_pixels = latent_pixels
+    decode = decode_pixels * profile["decode_bytes_per_latent"]
+    return {
+        "weights_gb": profile["weights_gb"],
+        "sampling_gb": round(sampling / GB, 2),
+        "decode_gb": round(decode / GB, 2),
+        "peak_gb": round(profile["weights_gb"] + max(sampling, decode) / GB, 2)
+    }
+
+
+def plan_resolution(width: int, height: int, batch_size: int = 1, free_vram_gb: Optional[float] = None,
+                    model: str = "flux", headroom_gb: float = 1.5) -> Dict[str, Any]:
+    """Snapped size, VRAM estimate and whether the decode has to be tiled
+
+    free_vram_gb is the free memory from /system_stats (model weights already
+    resident), or None when unknown; then only decodes above 8 GB are tiled.
+    """
+    snapped_w, snapped_h, aspect = snap_resolution(width, height)
+    estimate = estimate_vram(snapped_w, snapped_h, batch_size, model)
+    budget = (free_vram_gb - headroom_gb) if free_vram_gb is not None else 8.0
+    tiled = estimate["decode_gb"] > budget
+    plan = {
+        "requested": [int(width), int(height)],
+        "width": snapped_w,
+        "height": snapped_h,
+        "aspect": aspect,
+        "vram_estimate": estimate,
+        "free_vram_gb": round(free_vram_gb, 2) if free_vram_gb is not None else None,
+        "tiled_decode": tiled
+    }
+    if tiled:
+        plan["tile_size"] = TILE_SIZE
+        plan["tiled_decode_gb"] = estimate_vram(snapped_w, snapped_h, batch_size, model, TILE_SIZE)["decode_gb"]
+    return plan
+
+
+def use_tiled_decode(workflow, tile_size: int = TILE_SIZE, overlap: int = TILE_OVERLAP) -> int:
+    """Switch every VAEDecode in a WorkflowInstance to VAEDecodeTiled, returns nodes changed"""
+    changed = 0
+    for node_id in workflow.roles.vae_decode:
+        if workflow[node_id]["class_type"] != "VAEDecode":
+            continue
+        node = workflow.edit(node_id)
+        node["class_type"] = "VAEDecodeTiled"
+        # temporal_* only apply to video VAEs but are required inputs on current ComfyUI
+        node["inputs"].update(tile_size=tile_size, overlap=overlap, temporal_size=64, temporal_overlap=8)
+        changed += 1
+    return changed
@@ -0,0 +1,108 @@
+"""
+Header-only safetensors inspection
+Reads just the 8-byte length prefix and the JSON header of a .safetensors
+file (locally or with two range reads against an HttpSource/S3Source) and
+classifies which base model a LoRA was trained for, so incompatible LoRAs can
+be rejected before hundreds of MB are downloaded.
+"""
+
+import json
+import struct
+from typing import Dict, Any, Optional
+
+# Headers are small (tens to hundreds of KB); anything bigger is not safetensors
+MAX_HEADER_BYTES = 64 * 1024 * 1024
+
+# ss_base_model_version values written by kohya-ss / ai-toolkit
+METADATA_ARCHS = (
+    ("flux", "flux"),
+    ("sdxl", "sdxl"),
+    ("sd3", "sd3"),
+    ("sd_v2", "sd2"),
+    ("sd_v1", "sd15")
+)
+
+
+def _read_range(source, start: int, end: int) -> bytes:
+    return b"".join(source.read(start, end))
+
+
+def read_header(source) -> Dict[str, Any]:
+    """Fetch the JSON header through a ranged_download source (two small range reads)"""
+    prefix = _read_range(source, 0, 7)
+    if len(prefix) != 8:
+        raise ValueError("File too short for a safetensors header")
+    (length,) = struct.unpack("<Q", prefix)
+    if length == 0 or length > MAX_HEADER_BYTES:
+        raise ValueError(f"Implausible safetensors header length: {length}")
+    return json.loads(_read_range(source, 8, 8 + length - 1))
+
+
+def read_header_file(path: str) -> Dict[str, Any]:
+    """Read the JSON header of a local .safetensors file"""
+    with open(path, "rb") as f:
+        prefix = f.read(8)
+        if len(prefix) != 8:
+            raise ValueError("File too short for a safetensors header")
+        (length,) = struct.unpack("<Q", prefix)
+        if length == 0 or length > MAX_HEADER_BYTES:
+            raise ValueError(f"Implausible safetensors header length: {length}")
+        return json.loads(f.read(length))
+
+
+def _arch_from_keys(tensors: Dict[str, Any]) -> str:
+    keys = list(tensors)
+
+    def has(*fragments):
+        return any(fragment in key for key in keys for fragment in fragments)
+
+    if has("double_blocks", "single_blocks", "single_transformer_blocks"):
+        return "flux"
+    if has("joint_blocks", "context_block"):
+        return "sd3"
+    if has("lora_te2_", "text_encoder_2", "input_blocks", "output_blocks"):
+        return "sdxl"
+    if has("down_blocks", "up_blocks", "lora_te_", "lora_te1_"):
+        # SD1.x cross-attention keys project from the 768-d CLIP-L context,
+        # SD2.x from 1024-d OpenCLIP, SDXL from 2048-d
+        for key, info in tensors.items():
+            if "attn2_to_k" in key.replace(".", "_") and ("lora_down" in key or "lora_A" in key):
+                in_dim = (info.get("shape") or [0, 0])[-1]
+                return {768: "sd15", 1024: "sd2", 2048: "sdxl"}.get(in_dim, "sd15")
+        return "sd15"
+    return "unknown"
+
+
+def classify(header: Dict[str, Any]) -> Dict[str, Any]:
+    """Summarize a safetensors header: base architecture, tensor count and LoRA rank"""
+    metadata = header.get("__metadata__") or {}
+    tensors = {k: v for k, v in header.items() if k != "__metadata__" and isinstance(v, dict)}
+
+    arch = None
+    base_version = str(metadata.get("ss_base_model_version", "")).lower()
+    for fragment, name in METADATA_ARCHS:
+        if fragment in base_version:
+            arch = name
+            break
+    if arch is None:
+        arch = _arch_from_keys(tensors)
+
+    rank = None
+    for key, info in tensors.items():
+        if ("lora_down" in key or "lora_A" in key) and info.get("shape"):
+            rank = info["shape"][0]
+            break
+
+    return {
+        "arch": arch,
+        "tensors": len(tensors),
+        "rank": rank,
+        "base_model": metadata.get("ss_base_model_version") or None
+    }
+
+
+def is_compatible(summary: Optional[Dict[str, Any]], target: str = "flux") -> bool:
+    """Unknown layouts are let through; only a positively identified mismatch fails"""
+    if not summary:
+        return True
+    return summary.get("arch") in (target, "unknown")
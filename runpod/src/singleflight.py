@@ -0,0 +1,90 @@
+"""
+Single-flight coordination for expensive per-key work (LoRA fetches)
+Within a process, concurrent callers for the same key share one execution.
+Across processes (ComfyUI, a sidecar preloader) an flock'd lock file next to
+the target serializes the work, and a re-check after acquiring the lock lets
+late arrivals reuse the winner's result.
+"""
+
+import contextlib
+import os
+import re
+import threading
+from typing import Any, Callable, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: in-process coordination only
+    fcntl = None
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Run fn once per key while other callers await its result"""
+
+    def __init__(self, lock_dir: str = None):
+        self.lock_dir = lock_dir
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        self.counters = {"executed": 0, "shared": 0}
+
+    def lock_path(self, key: str) -> str:
+        safe = re.sub(r'[^A-Za-z0-9._-]', '_', key)
+        return os.path.join(self.lock_dir, f".{safe}.lock")
+
+    @contextlib.contextmanager
+    def _file_lock(self, key: str):
+        if not self.lock_dir or fcntl is None:
+            yield
+            return
+        os.makedirs(self.lock_dir, exist_ok=True)
+        with open(self.lock_path(key), 'a+') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def do(self, key: str, fn: Callable[[], Any], check: Callable[[], Any] = None) -> Any:
+        """Return fn()'s result, sharing one execution among concurrent callers
+
+        check, if given, runs after the cross-process lock is acquired; a
+        truthy result means another process already did the work and fn is
+        skipped.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            with self._lock:
+                self.counters["shared"] += 1
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            with self._file_lock(key):
+                result = check() if check else None
+                if not result:
+                    result = fn()
+                    with self._lock:
+                        self.counters["executed"] += 1
+                call.result = result
+            return result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
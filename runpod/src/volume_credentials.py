@@ -0,0 +1,217 @@
+"""
+Background credential bootstrap for the S3 volume
+Credentials are resolved off the import path: an encrypted copy cached on the
+network volume is used straight away if it has not expired, and the Firebase
+function is only called to refresh it in the background. The boto3 client is
+built the first time a LoRA lookup actually needs it, so text-to-image jobs
+never wait on credentials.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Any, Optional
+
+from runpod.serverless.modules.rp_logger import RunPodLogger
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
+    InvalidToken = Exception
+
+logger = RunPodLogger()
+
+REQUIRED_KEYS = ("S3_ENDPOINT", "S3_BUCKET", "S3_ACCESS_KEY", "S3_SECRET_KEY")
+
+
+def _cipher(secret: str):
+    """Fernet keyed from a worker secret, or None if encryption is unavailable"""
+    if Fernet is None or not secret:
+        return None
+    key = hashlib.sha256(b"amlwd-volume-credentials:" + secret.encode("utf-8")).digest()
+    return Fernet(base64.urlsafe_b64encode(key))
+
+
+def _complete(creds: Optional[Dict[str, Any]]) -> bool:
+    return bool(creds) and all(creds.get(k) for k in REQUIRED_KEYS)
+
+
+class CredentialBootstrap:
+    """Resolves S3 volume credentials in a background thread and keeps them fresh"""
+
+    def __init__(self, fetch: Callable[[], Optional[Dict[str, Any]]],
+                 fallback: Callable[[], Optional[Dict[str, Any]]],
+                 cache_path: Optional[str], secret: str,
+                 ttl: float = 6 * 3600, retry_interval: float = 60):
+        self.fetch = fetch
+        self.fallback = fallback
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.retry_interval = retry_interval
+        self._cipher = _cipher(secret)
+        self._credentials: Optional[Dict[str, Any]] = None
+        self._expires_at = 0.0
+        self._resolved = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._started_at = None
+        self.version = 0
+        self.source = None
+        # Seconds from start() until the first resolution attempt finished
+        self.resolve_seconds: Optional[float] = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._started_at = time.time()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _set(self, creds: Dict[str, Any], source: str, expires_at: float):
+        with self._lock:
+            if creds != self._credentials:
+                self.version += 1
+            self._credentials = dict(creds)
+            self._expires_at = expires_at
+            self.source = source
+        logger.info(f"S3 volume credentials resolved from {source}")
+
+    def _run(self):
+        cached = self._load_cache()
+        if cached:
+            creds, expires_at = cached
+            self._set(creds, "volume cache", expires_at)
+            self._mark_resolved()
+
+        failures = 0
+        warned = False
+        while True:
+            delay = self.retry_interval
+            if time.time() >= self._expires_at - self.ttl * 0.1:
+                try:
+                    creds = self.fetch()
+                except Exception as e:
+                    logger.warn(f"Credential refresh failed: {e}")
+                    creds = None
+                if _complete(creds):
+                    failures = 0
+                    expires_at = time.time() + self.ttl
+                    self._set(creds, "firebase", expires_at)
+                    self._save_cache(creds, expires_at)
+                else:
+                    # Back off exponentially, up to the TTL, while Firebase keeps failing
+                    failures += 1
+                    delay = min(self.retry_interval * 2 ** min(failures - 1, 16), self.ttl)
+                    if self._credentials is None:
+                        creds = self.fallback()
+                        if _complete(creds):
+                            # Firebase is retried once the TTL is mostly used up
+                            self._set(creds, "environment", time.time() + self.ttl)
+                        elif not warned:
+                            logger.warn("S3 volume not configured - LoRAs will use local storage")
+                            warned = True
+            else:
+                delay = max(self.retry_interval, self._expires_at - self.ttl * 0.1 - time.time())
+            self._mark_resolved()
+            time.sleep(delay)
+
+    def _mark_resolved(self):
+        if not self._resolved.is_set():
+            self.resolve_seconds = round(time.time() - self._started_at, 3)
+            logger.info(f"S3 volume credential lookup finished in {self.resolve_seconds}s")
+            self._resolved.set()
+
+    def _load_cache(self):
+        if not self._cipher or not self.cache_path:
+            return None
+        try:
+            with open(self.cache_path, "rb") as f:
+                payload = json.loads(self._cipher.decrypt(f.read()))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, InvalidToken) as e:
+            logger.warn(f"Ignoring unreadable credential cache: {e}")
+            return None
+        if payload.get("expires_at", 0) <= time.time() or not _complete(payload.get("credentials")):
+            return None
+        return payload["credentials"], payload["expires_at"]
+
+    def _save_cache(self, creds: Dict[str, Any], expires_at: float):
+        if not self._cipher or not self.cache_path:
+            return
+        token = self._cipher.encrypt(json.dumps({"credentials": creds, "expires_at": expires_at}).encode("utf-8"))
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "wb") as f:
+                f.write(token)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            logger.warn(f"Could not cache S3 volume credentials: {e}")
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Credentials once the first resolution attempt finished (or timeout), else None"""
+        self._resolved.wait(timeout)
+        with self._lock:
+            return dict(self._credentials) if self._credentials else None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "source": self.source,
+                "resolved": self._resolved.is_set(),
+                "resolve_seconds": self.resolve_seconds,
+                "expires_in": round(self._expires_at - time.time()) if self._expires_at else None
+            }
+
+
+class S3Volume:
+    """Lazily built boto3 client for the volume bucket, rebuilt when credentials rotate"""
+
+    def __init__(self, bootstrap: CredentialBootstrap, wait: float = 15, region: str = 'US-KS-2'):
+        self.bootstrap = bootstrap
+        self.wait = wait
+        self.region = region
+        self._client = None
+        self._client_version = None
+        self._lock = threading.Lock()
+
+    def available(self, wait: Optional[float] = None) -> bool:
+        """True if credentials are resolved, waiting for the bootstrap at most `wait` seconds"""
+        return _complete(self.bootstrap.wait(self.wait if wait is None else wait))
+
+    @property
+    def bucket(self) -> Optional[str]:
+        creds = self.bootstrap.wait(0) or {}
+        return creds.get('S3_BUCKET')
+
+    @property
+    def client(self):
+        creds = self.bootstrap.wait(self.wait)
+        if not _complete(creds):
+            return None
+        with self._lock:
+            if self._client is None or self._client_version != self.bootstrap.version:
+                import boto3
+                from botocore.config import Config
+
+                logger.info("Setting up S3 volume client for LoRA storage...")
+                self._client = boto3.client(
+                    's3',
+                    endpoint_url=creds['S3_ENDPOINT'],
+                    aws_access_key_id=creds['S3_ACCESS_KEY'],
+                    aws_secret_access_key=creds['S3_SECRET_KEY'],
+                    config=Config(
+                        region_name=self.region,
+                        signature_version='s3v4',
+                        s3={'addressing_style': 'path'}
+                    )
+                )
+                self._client_version = self.bootstrap.version
+                logger.info(f"S3 volume client configured for bucket: {creds.get('S3_BUCKET')}")
+            return self._client
@@ -0,0 +1,195 @@
+"""
+In-memory workflow template registry
+Templates are parsed, canonicalized and validated once, held frozen, and handed to jobs as
+copy-on-write instances. A background watcher hot-reloads changed files so
+jobs never touch the (network-mounted) filesystem.
+"""
+
+import json
+import os
+import threading
+import time
+from types import MappingProxyType
+from typing import Dict, List, Optional, Iterable
+
+from runpod.serverless.modules.rp_logger import RunPodLogger
+from workflow_roles import RoleIndex, SEED_INPUTS, compile_roles
+from canonical_graph import canonicalize
+
+logger = RunPodLogger()
+
+
+def freeze(value):
+    """Recursively convert dicts/lists into read-only mappings/tuples"""
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def thaw(value):
+    """Inverse of freeze, producing plain JSON-compatible structures"""
+    if isinstance(value, (dict, MappingProxyType)):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [thaw(v) for v in value]
+    return value
+
+
+def validate_workflow(workflow: Dict) -> List[str]:
+    """Structural checks shared by the registry and validate_workflows.py"""
+    issues = []
+    if not isinstance(workflow, (dict, MappingProxyType)) or not workflow:
+        return ["Workflow is empty or not an object"]
+    for node_id, node in workflow.items():
+        if 'class_type' not in node:
+            issues.append(f"Node {node_id} missing 'class_type'")
+        if 'inputs' not in node:
+            issues.append(f"Node {node_id} missing 'inputs'")
+            continue
+        for input_name, input_value in node['inputs'].items():
+            if isinstance(input_value, (list, tuple)) and len(input_value) == 2:
+                if str(input_value[0]) not in workflow:
+                    issues.append(f"Node {node_id} references non-existent node {input_value[0]}")
+    return issues
+
+
+class WorkflowInstance(dict):
+    """Per-job workflow that shares unmodified nodes with its template"""
+
+    def __init__(self, nodes, name: str = "dynamic", roles: RoleIndex = None):
+        super().__init__(nodes)
+        self.name = name
+        self._roles = roles
+
+    @property
+    def roles(self) -> RoleIndex:
+        """Role index, compiled on first use for dynamic and custom workflows"""
+        if self._roles is None:
+            self._roles = compile_roles(self)
+        return self._roles
+
+    def edit(self, node_id: str) -> Dict:
+        """Return a mutable node, copying it from the template on first write"""
+        node = self[node_id]
+        if not isinstance(node, dict):
+            node = self[node_id] = thaw(node)
+        return node
+
+    def add_nodes(self, nodes: Dict[str, Dict]):
+        """Insert new nodes; the role index is recompiled on next use"""
+        self.update(nodes)
+        self._roles = None
+
+    def set_inputs(self, role: str, **values) -> int:
+        """Write inputs on every node bound to a role, returns nodes touched"""
+        nodes = self.roles.get(role)
+        for node_id in nodes:
+            self.edit(node_id)["inputs"].update(values)
+        return len(nodes)
+
+    def set_seed(self, seed: int, only_if_zero: bool = False):
+        """Set the seed on every seed-bearing node"""
+        for node_id in self.roles.seed:
+            field = SEED_INPUTS[self[node_id]["class_type"]]
+            if only_if_zero and self[node_id]["inputs"].get(field, 0) != 0:
+                continue
+            self.edit(node_id)["inputs"][field] = seed
+
+
+class WorkflowRegistry:
+    """Loads every template under the given directories once and watches for changes"""
+
+    def __init__(self, search_dirs: Iterable[str], reload_interval: float = 10.0):
+        # Earlier directories take precedence for templates with the same name
+        self.search_dirs = [d for d in search_dirs if d]
+        self.reload_interval = reload_interval
+        self._templates: Dict[str, MappingProxyType] = {}
+        self._roles: Dict[str, RoleIndex] = {}
+        self._sources: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self._watcher = None
+
+    def _scan(self) -> Dict[str, str]:
+        """Map template name -> path, honouring directory precedence"""
+        found = {}
+        for directory in self.search_dirs:
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.name.endswith('.json') and entry.is_file():
+                    found.setdefault(entry.name[:-len('.json')], entry.path)
+        return found
+
+    def load_all(self) -> int:
+        """(Re)load any template whose file is new or changed, returns count loaded"""
+        loaded = 0
+        for name, path in self._scan().items():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            signature = (path, stat.st_mtime_ns, stat.st_size)
+            if self._sources.get(name) == signature:
+                continue
+            try:
+                with open(path, 'r') as f:
+                    workflow = json.load(f)
+            except Exception as e:
+                logger.error(f"Failed to parse workflow {path}: {e}")
+                continue
+            # Shared loader IDs keep ComfyUI's loader outputs cached across templates
+            workflow = canonicalize(workflow)
+            issues = validate_workflow(workflow)
+            if issues:
+                logger.error(f"Workflow {path} failed validation: {issues}")
+                continue
+            roles = compile_roles(workflow)
+            with self._lock:
+                reloading = name in self._templates
+                self._templates[name] = freeze(workflow)
+                self._roles[name] = roles
+                self._sources[name] = signature
+            loaded += 1
+            logger.info(f"{'Reloaded' if reloading else 'Loaded'} workflow template '{name}' from {path}")
+        return loaded
+
+    def start_watcher(self):
+        """Poll template directories in the background for hot reload"""
+        if self._watcher and self._watcher.is_alive():
+            return
+
+        def watch():
+            while True:
+                time.sleep(self.reload_interval)
+                try:
+                    self.load_all()
+                except Exception as e:
+                    logger.warn(f"Workflow reload failed: {e}")
+
+        self._watcher = threading.Thread(target=watch, daemon=True)
+        self._watcher.start()
+
+    def names(self) -> List[str]:
+        with self._lock:
+            return sorted(self._templates)
+
+    def template(self, name: str) -> Optional[MappingProxyType]:
+        with self._lock:
+            return self._templates.get(name)
+
+    def roles(self, name: str) -> Optional[RoleIndex]:
+        with self._lock:
+            return self._roles.get(name)
+
+    def instantiate(self, name: str) -> WorkflowInstance:
+        """Cheap per-job copy: a new top-level dict over the frozen nodes"""
+        with self._lock:
+            template = self._templates.get(name)
+            roles = self._roles.get(name)
+        if template is None:
+            raise FileNotFoundError(f"Workflow template not found: {name}")
+        return WorkflowInstance(template, name=name, roles=roles)
@@ -0,0 +1,165 @@
+"""
+Node-role index for ComfyUI workflows
+Compiles a workflow once into the node IDs that play each role (prompt,
+latent, sampler, LoRA chain, ...) so per-job patching is a handful of direct
+slot writes instead of repeated full-graph scans.
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+TEXT_ENCODERS = ("CLIPTextEncode", "CLIPTextEncodeFlux")
+SAMPLERS = ("KSampler", "KSamplerAdvanced", "SamplerCustomAdvanced")
+LORA_LOADERS = ("LoraLoader", "LoraLoaderModelOnly")
+MODEL_LOADERS = ("UNETLoader", "CheckpointLoaderSimple")
+
+# Input holding the seed for each seed-bearing node type
+SEED_INPUTS = {
+    "KSampler": "seed",
+    "KSamplerAdvanced": "noise_seed",
+    "RandomNoise": "noise_seed"
+}
+
+ROLES = (
+    "positive_prompt",
+    "negative_prompt",
+    "latent",
+    "sampler",
+    "seed",
+    "lora_chain",
+    "load_image",
+    "vae_encode",
+    "vae_decode",
+    "save_image",
+    "checkpoint"
+)
+
+# Roles every generation workflow must bind (latent may come from VAEEncode)
+REQUIRED_ROLES = ("positive_prompt", "sampler", "save_image")
+
+
+class RoleIndex:
+    """Immutable mapping of role name -> tuple of node IDs"""
+
+    def __init__(self, roles: Dict[str, Tuple[str, ...]]):
+        self._roles = {role: tuple(roles.get(role, ())) for role in ROLES}
+
+    def __getattr__(self, role: str) -> Tuple[str, ...]:
+        try:
+            return self.__dict__['_roles'][role]
+        except KeyError:
+            raise AttributeError(role)
+
+    def get(self, role: str) -> Tuple[str, ...]:
+        return self._roles.get(role, ())
+
+    def first(self, role: str) -> Optional[str]:
+        nodes = self._roles.get(role, ())
+        return nodes[0] if nodes else None
+
+    def unbound(self, roles=ROLES) -> List[str]:
+        return [role for role in roles if not self._roles.get(role)]
+
+    def to_dict(self) -> Dict[str, List[str]]:
+        return {role: list(nodes) for role, nodes in self._roles.items() if nodes}
+
+
+def _link(node, input_name: str) -> Optional[str]:
+    """Upstream node ID of a linked input, if any"""
+    value = node.get("inputs", {}).get(input_name)
+    if isinstance(value, (list, tuple)) and len(value) == 2:
+        return str(value[0])
+    return None
+
+
+def _trace_text(workflow, node_id: Optional[str]) -> Optional[str]:
+    """Follow a conditioning chain upstream to its text encoder"""
+    seen = set()
+    while node_id and node_id in workflow and node_id not in seen:
+        seen.add(node_id)
+        node = workflow[node_id]
+        class_type = node.get("class_type")
+        if class_type in TEXT_ENCODERS:
+            return node_id
+        if class_type == "ConditioningZeroOut":
+            # An empty negative derived from the positive prompt
+            return None
+        node_id = _link(node, "conditioning")
+    return None
+
+
+def _trace_loras(workflow, node_id: Optional[str]) -> List[str]:
+    """LoRA loaders between a model consumer and its model loader, loader-first"""
+    chain = []
+    seen = set()
+    while node_id and node_id in workflow and node_id not in seen:
+        seen.add(node_id)
+        node = workflow[node_id]
+        if node.get("class_type") in LORA_LOADERS:
+            chain.append(node_id)
+        elif node.get("class_type") in MODEL_LOADERS:
+            break
+        node_id = _link(node, "model")
+    chain.reverse()
+    return chain
+
+
+def _sort_ids(ids):
+    return sorted(ids, key=lambda n: (len(n), n))
+
+
+def compile_roles(workflow) -> RoleIndex:
+    """Single pass over the graph plus short upstream traces from each sampler"""
+    by_class: Dict[str, List[str]] = {}
+    for node_id in _sort_ids(str(n) for n in workflow.keys()):
+        by_class.setdefault(workflow[node_id].get("class_type"), []).append(node_id)
+
+    def of(*classes):
+        return [nid for c in classes for nid in by_class.get(c, [])]
+
+    samplers = of(*SAMPLERS)
+    positive, negative, loras = [], [], []
+    for sampler_id in samplers:
+        sampler = workflow[sampler_id]
+        positive_src = _link(sampler, "positive")
+        negative_src = _link(sampler, "negative")
+        model_src = _link(sampler, "model")
+
+        guider_id = _link(sampler, "guider")
+        if guider_id and guider_id in workflow:
+            guider = workflow[guider_id]
+            positive_src = _link(guider, "conditioning") or _link(guider, "positive")
+            negative_src = _link(guider, "negative")
+            model_src = _link(guider, "model")
+
+        for source, bucket in ((positive_src, positive), (negative_src, negative)):
+            text_id = _trace_text(workflow, source)
+            if text_id and text_id not in bucket:
+                bucket.append(text_id)
+        for lora_id in _trace_loras(workflow, model_src):
+            if lora_id not in loras:
+                loras.append(lora_id)
+
+    if not positive:
+        # Disconnected or unusual graphs: fall back to titles
+        for node_id in of(*TEXT_ENCODERS):
+            title = workflow[node_id].get("_meta", {}).get("title", "").lower()
+            if "negative" in title:
+                negative.append(node_id)
+            else:
+                positive.append(node_id)
+    if not loras:
+        loras = of(*LORA_LOADERS)
+
+    return RoleIndex({
+        "positive_prompt": positive,
+        "negative_prompt": [n for n in negative if n not in positive],
+        "latent": of("EmptyLatentImage", "EmptySD3LatentImage"),
+        "sampler": samplers,
+        "seed": [nid for nid in of(*SEED_INPUTS) if SEED_INPUTS[workflow[nid]["class_type"]] in workflow[nid].get("inputs", {})],
+        "lora_chain": loras,
+        "load_image": of("LoadImage"),
+        "vae_encode": of("VAEEncode"),
+        "vae_decode": of("VAEDecode", "VAEDecodeTiled"),
+        "save_image": of("SaveImage"),
+        "checkpoint": of("CheckpointLoaderSimple")
+    })
@@ -4,8 +4,13 @@ Validate FLUX workflows without requiring RunPod environment
 """
 
 import json
+import os
 import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from workflow_roles import compile_roles, REQUIRED_ROLES, ROLES
+from resolution_planner import plan_resolution
+
 def validate_workflow(filepath):
     """Validate a single workflow file"""
     print(f"\n=== Validating {filepath} ===")
@@ -81,8 +86,11 @@ def validate_workflow(filepath):
             width = inputs.get('width', 1024)
             height = inputs.get('height', 1024)
             print(f"  ✓ Dimensions: {width}x{height}")
-            if width > 1024 or height > 1024:
-                warnings.append(f"Large dimensions ({width}x{height}) will be slow")
+            plan = plan_resolution(width, height, inputs.get('batch_size', 1))
+            if (plan['width'], plan['height']) != (width, height):
+                warnings.append(f"Dimensions {width}x{height} are not a supported bucket; jobs snap them to {plan['width']}x{plan['height']}")
+            if plan['vram_estimate']['peak_gb'] > 24:
+                warnings.append(f"Dimensions {width}x{height} need ~{plan['vram_estimate']['peak_gb']} GB peak VRAM; smaller GPUs fall back to a tiled VAE decode")
                 
         elif node_class == 'CLIPTextEncode':
             text = inputs.get('text', '')
@@ -98,6 +106,19 @@ def validate_workflow(filepath):
                 else:
                     print(f"  ✓ {input_name} connected to node {ref_node_id}[{ref_output}]")
     
+    # Role bindings used by the handlers to patch the workflow
+    roles = compile_roles(workflow)
+    print("\nRole bindings:")
+    for role, node_ids in roles.to_dict().items():
+        print(f"  ✓ {role}: {', '.join(node_ids)}")
+    for role in roles.unbound(REQUIRED_ROLES):
+        issues.append(f"Required role '{role}' is not bound to any node")
+    if not roles.latent and not roles.vae_encode:
+        issues.append("No latent source (EmptyLatentImage or VAEEncode) bound")
+    unbound = [r for r in roles.unbound(ROLES) if r not in REQUIRED_ROLES]
+    if unbound:
+        print(f"  - Unbound roles: {', '.join(unbound)}")
+
     # Summary
     print(f"\n=== Summary for {filepath} ===")
     if issues:
@@ -3,29 +3,25 @@
 Transfer LoRA from Firebase Storage to RunPod S3 volume
 """
 
-import requests
 import boto3
 from botocore.config import Config
 import os
 import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'runpod', 'src'))
+from ranged_download import HttpSource, download
+
 def download_from_url(url, filename):
-    """Download file from URL"""
+    """Download file from URL (parallel ranged download)"""
     print(f"Downloading from: {url[:100]}...")
-    response = requests.get(url, stream=True)
-    response.raise_for_status()
     
-    total_size = int(response.headers.get('content-length', 0))
+    def on_progress(downloaded, total_size):
+        if total_size:
+            percent = (downloaded / total_size) * 100
+            print(f"\rProgress: {percent:.1f}%", end='')
     
-    with open(filename, 'wb') as f:
-        downloaded = 0
-        for chunk in response.iter_content(chunk_size=8192):
-            f.write(chunk)
-            downloaded += len(chunk)
-            if total_size > 0:
-                percent = (downloaded / total_size) * 100
-                print(f"\rProgress: {percent:.1f}%", end='')
-    print("\nDownload complete!")
+    stats = download(HttpSource(url), filename, on_progress=on_progress)
+    print(f"\nDownload complete! ({stats['mb_per_s']} MB/s)")
     return filename
 
 def upload_to_s3(local_file, s3_key):
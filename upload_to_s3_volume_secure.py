@@ -11,6 +11,9 @@ import sys
 import requests
 from pathlib import Path
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'runpod', 'src'))
+from ranged_download import S3Source, download
+
 def get_s3_credentials():
     """Fetch S3 credentials from Firebase"""
     
@@ -174,9 +177,10 @@ def download_lora_from_s3(lora_name, output_path=None):
     print(f"Downloading {lora_name} from S3 volume...")
     
     try:
-        s3_client.download_file(bucket, key, output_path)
-        file_size = os.path.getsize(output_path) / (1024 * 1024)
+        stats = download(S3Source(s3_client, bucket, key), output_path)
+        file_size = stats['bytes'] / (1024 * 1024)
         print(f"✅ Downloaded {lora_name} ({file_size:.1f} MB) to {output_path}")
+        print(f"   {stats['parts']} parts at {stats['mb_per_s']} MB/s")
         return True
     except Exception as e:
         print(f"❌ Error downloading: {e}")